@@ -0,0 +1,309 @@
+# IConvo/app_config.py
+
+import logging
+import os
+from types import MappingProxyType
+import yaml
+from audio_recorder import DEFAULT_CAPTURE_PROFILE, DEFAULT_ENDPOINTING, UPLOAD_FORMATS
+from conversation_log import DEFAULT_CONVERSATION_LOG
+from openai_client import DEFAULT_CLIENT_SETTINGS, DEFAULT_LOCAL_SERVER
+from providers import DEFAULT_PROVIDERS, PROVIDERS
+from response_cache import DEFAULT_RESPONSE_CACHE
+from speech_to_text import DEFAULT_FASTER_WHISPER
+from tracing import DEFAULT_TRACING
+from tts_cache import DEFAULT_TTS_CACHE
+
+# config.yaml is parsed and checked once, into an immutable snapshot: a
+# read-only mapping whose values already have the right types, so callers
+# use config["max_history_length"] as an int instead of converting it every
+# turn. Every key in SCHEMA is present, and blocks such as tracing are filled
+# in from their module's defaults, so code that gets a snapshot indexes it
+# directly and never supplies defaults of its own. A ConfigStore holds the
+# current snapshot and swaps in a new one when the file is saved or changes
+# on disk.
+CONFIG_PATH = "config.yaml"
+REQUIRED = object()
+
+class ConfigError(ValueError):
+    pass
+
+def to_int(value):
+    if isinstance(value, bool):
+        raise ValueError(f"expected a whole number, got {value!r}")
+    return int(str(value).strip())
+
+def to_float(value):
+    if isinstance(value, bool):
+        raise ValueError(f"expected a number, got {value!r}")
+    return float(value)
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "yes", "on", "1"):
+        return True
+    if text in ("false", "no", "off", "0"):
+        return False
+    raise ValueError(f"expected true or false, got {value!r}")
+
+def to_text(value):
+    if value is None or isinstance(value, (dict, list)):
+        raise ValueError(f"expected text, got {value!r}")
+    return str(value)
+
+def optional(convert):
+    return lambda value: None if value is None else convert(value)
+
+def ranged(convert, minimum=None, maximum=None):
+    def check(value):
+        value = convert(value)
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            bounds = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+            raise ValueError(f"must be {bounds}, got {value}")
+        return value
+    return check
+
+def to_size(value):
+    # "1600,1600", "(1600, 1600)" or a two-item list
+    parts = value if isinstance(value, (list, tuple)) else str(value).strip("()[] ").split(",")
+    size = tuple(to_int(part) for part in parts)
+    if len(size) != 2 or min(size) <= 0:
+        raise ValueError(f"expected width,height, got {value!r}")
+    return size
+
+def choice(*options):
+    def check(value):
+        if value not in options:
+            raise ValueError(f"expected one of {', '.join(options)}, got {value!r}")
+        return value
+    return check
+
+def to_rollover(value):
+    # The intervals TimedRotatingFileHandler accepts, in any case
+    text = to_text(value).strip().lower()
+    if text not in ("s", "m", "h", "d", "midnight") and not (len(text) == 2 and text[0] == "w" and text[1] in "0123456"):
+        raise ValueError(f"expected s, m, h, d, midnight or w0-w6, got {value!r}")
+    return text
+
+def to_provider(kind):
+    # Checked when the config is parsed, so providers registered after import count too
+    return lambda value: choice(*PROVIDERS[kind])(to_text(value))
+
+def to_section(value):
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError(f"expected a mapping, got {value!r}")
+    return value
+
+def to_commands(value):
+    return {str(command): tuple(str(keyword) for keyword in keywords or ()) for command, keywords in to_section(value).items()}
+
+# Top-level keys: (converter, default).
+SCHEMA = {
+    "api_key": (to_text, REQUIRED),
+    "model": (to_text, REQUIRED),
+    "system_prompt": (to_text, ""),
+    "summary_model": (optional(to_text), None),
+    "whisper_model": (to_text, "whisper-1"),
+    "tts_model": (to_text, "tts-1"),
+    "tts_voice": (to_text, "alloy"),
+    "voice": (optional(to_text), None),
+    "user_name": (to_text, "User"),
+    "assistant_name": (to_text, "Assistant"),
+    "user_color": (to_text, "blue"),
+    "assistant_color": (to_text, "green"),
+    "log_file": (to_text, os.path.join("logs", "chat_log.txt")),
+    "audio_path": (to_text, os.path.join("data", "audio", "audio.wav")),
+    "image_path": (to_text, os.path.join("data", "images", "screenshot.jpeg")),
+    "push_to_talk_key": (to_text, "shift"),
+    "capture_area": (to_text, "screen"),
+    "max_history_length": (ranged(to_int, 2), 20),
+    "max_history_tokens": (optional(ranged(to_int, 0)), None),
+    "max_response_tokens": (ranged(to_int, 1), 500),
+    "max_summary_tokens": (ranged(to_int, 1), 300),
+    "image_max_size": (to_size, (1600, 1600)),
+    "image_quality": (ranged(to_int, 1, 100), 90),
+    "video_scene_threshold": (ranged(to_float, 0, 1), 0.0),
+    "console_scrollback_lines": (ranged(to_int, 0), 5000),
+    "stream_responses": (to_bool, False),
+    "in_memory_audio": (to_bool, False),
+    "summarize_history": (to_bool, False),
+    "compact_sent_images": (to_bool, False),
+    "chunked_transcription": (to_bool, False),
+    "barge_in": (to_bool, False),
+    "commands": (to_commands, {}),
+}
+# Blocks: (defaults, converter per setting). Settings left out get the
+# module's default; unknown settings are kept as they are.
+SECTIONS = {
+    "audio_capture": (DEFAULT_CAPTURE_PROFILE, {
+        "sample_rate": ranged(to_int, 8000),
+        "upload_sample_rate": ranged(to_int, 8000),
+        "upload_format": choice(*UPLOAD_FORMATS),
+    }),
+    "endpointing": (DEFAULT_ENDPOINTING, {
+        "silence_hangover": ranged(to_float, 0),
+        "min_speech_duration": ranged(to_float, 0),
+        "max_utterance_duration": ranged(to_float, 1),
+        "pre_roll": ranged(to_float, 0),
+        "min_energy": ranged(to_float, 0),
+        "speech_ratio": ranged(to_float, 0),
+        "segment_pause": ranged(to_float, 0),
+        "min_segment_duration": ranged(to_float, 0),
+    }),
+    "openai_client": (DEFAULT_CLIENT_SETTINGS, {
+        "max_connections": ranged(to_int, 1),
+        "max_keepalive_connections": ranged(to_int, 0),
+        "keepalive_expiry": ranged(to_float, 0),
+        "timeout": ranged(to_float, 0),
+        "connect_timeout": ranged(to_float, 0),
+        "max_retries": ranged(to_int, 0),
+        "prewarm": to_bool,
+    }),
+    "local_server": (DEFAULT_LOCAL_SERVER, {
+        "base_url": to_text,
+        "api_key": to_text,
+    }),
+    "providers": (DEFAULT_PROVIDERS, {kind: to_provider(kind) for kind in DEFAULT_PROVIDERS}),
+    "faster_whisper": (DEFAULT_FASTER_WHISPER, {
+        "model": to_text,
+        "device": to_text,
+        "compute_type": to_text,
+        "beam_size": ranged(to_int, 1),
+    }),
+    "tts_cache": (DEFAULT_TTS_CACHE, {
+        "enabled": to_bool,
+        "directory": to_text,
+        "max_size_mb": ranged(to_float, 0),
+    }),
+    "response_cache": (DEFAULT_RESPONSE_CACHE, {
+        "enabled": to_bool,
+        "path": to_text,
+        "ttl_hours": ranged(to_float, 0),
+        "max_size_mb": ranged(to_float, 0),
+    }),
+    "tracing": (DEFAULT_TRACING, {
+        "enabled": to_bool,
+        "path": to_text,
+        "max_size_mb": ranged(to_float, 0),
+        "backup_count": ranged(to_int, 0),
+        "console_breakdown": to_bool,
+    }),
+    "conversation_log": (DEFAULT_CONVERSATION_LOG, {
+        "format": choice("text", "jsonl"),
+        "rotation": choice("size", "time"),
+        "max_size_mb": ranged(to_float, 0),
+        "when": to_rollover,
+        "backup_count": ranged(to_int, 0),
+        "compress": to_bool,
+    }),
+}
+
+def freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def parse_config(data):
+    # Returns a validated, read-only snapshot of data; raises ConfigError listing every problem
+    if not isinstance(data, dict):
+        raise ConfigError("The configuration must be a mapping of settings")
+    config = dict(data)
+    problems = []
+    for key, (convert, default) in SCHEMA.items():
+        if data.get(key) is None:
+            if default is REQUIRED:
+                problems.append(f"{key}: missing")
+            config[key] = default
+            continue
+        try:
+            config[key] = convert(data[key])
+        except (TypeError, ValueError) as e:
+            problems.append(f"{key}: {e}")
+    for section, (defaults, converters) in SECTIONS.items():
+        try:
+            values = to_section(data.get(section))
+        except ValueError as e:
+            problems.append(f"{section}: {e}")
+            continue
+        settings = dict(defaults)
+        settings.update((key, value) for key, value in values.items() if value is not None)
+        for key, value in settings.items():
+            try:
+                settings[key] = converters[key](value) if key in converters else value
+            except (TypeError, ValueError) as e:
+                problems.append(f"{section}.{key}: {e}")
+        config[section] = settings
+    if problems:
+        raise ConfigError("Invalid configuration:\n" + "\n".join(problems))
+    return freeze(config)
+
+def parse_config_text(text):
+    try:
+        data = yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        raise ConfigError(f"The configuration is not valid YAML: {e}")
+    return parse_config(data or {})
+
+def load_config(path=CONFIG_PATH):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"The configuration file '{path}' does not exist.")
+    with open(path, 'r', encoding='utf-8') as file:
+        return parse_config_text(file.read())
+
+def changed_keys(old, new):
+    return {key for key in old.keys() | new.keys() if old.get(key) != new.get(key)}
+
+class ConfigStore:
+    # Holds the current snapshot. The whole file is parsed and validated before
+    # the snapshot is replaced, in one assignment, so every thread sees either
+    # the old config or the new one and an invalid file changes nothing.
+    # Listeners are called with (old, new) on the thread that reloaded.
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = path
+        self.listeners = []
+        self.mtime = self.modified_time()
+        self.config = load_config(path)
+
+    def modified_time(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def apply(self, config):
+        old, self.config = self.config, config
+        for listener in self.listeners:
+            try:
+                listener(old, config)
+            except Exception as e:
+                logging.error(f"Applying the new configuration failed in {listener}: {e}")
+        return config
+
+    def save(self, text):
+        # Validates first; a config that does not load is never written
+        config = parse_config_text(text)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(temp_path, self.path)
+        self.mtime = self.modified_time()
+        return self.apply(config)
+
+    def check(self):
+        # Polled for changes made outside the app. Returns True if a new config
+        # was applied; a broken file raises ConfigError once, not on every poll.
+        mtime = self.modified_time()
+        if mtime is None or mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        self.apply(load_config(self.path))
+        return True
@@ -0,0 +1,136 @@
+# IConvo/audio_player.py
+
+import io
+import queue
+import threading
+import pygame
+
+# Clips are either a path to an audio file or encoded MP3 bytes held in memory
+def load_audio_clip(clip):
+    if isinstance(clip, (bytes, bytearray)):
+        pygame.mixer.music.load(io.BytesIO(clip), "mp3")
+    else:
+        pygame.mixer.music.load(clip)
+
+def describe_audio_clip(clip):
+    if isinstance(clip, (bytes, bytearray)):
+        return f"<{len(clip)} bytes in memory>"
+    return clip
+
+class AudioPlayer:
+    # Long-lived playback engine: the mixer is opened once, clips are played
+    # from a queue on a single worker thread, and interrupt() flushes the queue
+    # and stops the current clip straight away.
+
+    def __init__(self, max_queued_clips=0, poll_interval=0.02):
+        self.clips = queue.Queue(maxsize=max_queued_clips)
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.clip_finished = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        # Clips that are queued or playing; the player is idle when this is zero
+        self.pending = 0
+        # Bumped by interrupt() so clips queued before it are never played
+        self.generation = 0
+        self.current_clip = None
+        self.thread = None
+        self.closed = False
+
+    def start(self):
+        pygame.mixer.init()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def play(self, clip, on_done=None, on_start=None):
+        # Blocks while the queue is full so text-to-speech cannot run far ahead of playback.
+        # on_start(clip) is called when the clip actually starts playing, on_done(clip) once it is over
+        if self.closed:
+            return False
+        with self.lock:
+            self.pending += 1
+            self.idle.clear()
+            generation = self.generation
+        self.clips.put((clip, on_done, on_start, generation))
+        return True
+
+    def is_playing(self):
+        return not self.idle.is_set()
+
+    def wait_until_idle(self, timeout=None):
+        return self.idle.wait(timeout)
+
+    def interrupt(self):
+        # Drop everything that is still queued, then stop the clip that is playing
+        flushed = []
+        with self.lock:
+            self.generation += 1
+            while True:
+                try:
+                    item = self.clips.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    flushed.append(item)
+            self.release(len(flushed))
+            if self.current_clip is not None:
+                self.clip_finished.set()
+                pygame.mixer.music.stop()
+        for clip, on_done, _, _ in flushed:
+            if on_done:
+                on_done(clip)
+        # Wait for the worker to let go of the stopped clip, unless we are the worker
+        if threading.current_thread() is not self.thread:
+            self.idle.wait(1.0)
+        return len(flushed)
+
+    def release(self, count):
+        # Must be called with self.lock held
+        self.pending = max(0, self.pending - count)
+        if self.pending == 0:
+            self.idle.set()
+
+    def close(self):
+        if self.closed:
+            return
+        self.interrupt()
+        self.closed = True
+        self.clips.put(None)
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+        pygame.mixer.quit()
+
+    def run(self):
+        while True:
+            item = self.clips.get()
+            if item is None:
+                break
+            clip, on_done, on_start, generation = item
+            with self.lock:
+                stale = generation != self.generation
+                if stale:
+                    self.release(1)
+                else:
+                    self.current_clip = clip
+                    self.clip_finished.clear()
+            if stale:
+                if on_done:
+                    on_done(clip)
+                continue
+            try:
+                load_audio_clip(clip)
+                pygame.mixer.music.play()
+                if on_start:
+                    on_start(clip)
+                # interrupt() sets clip_finished, so this wakes up as soon as playback is stopped
+                while pygame.mixer.music.get_busy() and not self.clip_finished.wait(self.poll_interval):
+                    pass
+                # Release the clip so its file can be moved or deleted
+                pygame.mixer.music.unload()
+            except pygame.error as e:
+                print(f"Error playing audio clip {describe_audio_clip(clip)}: {e}")
+            with self.lock:
+                self.current_clip = None
+                self.release(1)
+            if on_done:
+                on_done(clip)
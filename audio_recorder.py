@@ -0,0 +1,324 @@
+# IConvo/audio_recorder.py
+
+import io
+import logging
+import wave
+from collections import deque
+import numpy as np
+
+# soundfile is optional; without it uploads fall back to WAV
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+# Whisper resamples everything to 16 kHz mono, so anything above that is wasted upload
+DEFAULT_CAPTURE_PROFILE = {
+    "sample_rate": 16000,
+    "upload_sample_rate": 16000,
+    "upload_format": "flac",
+}
+FALLBACK_SAMPLE_RATE = 44100
+DEFAULT_ENDPOINTING = {
+    "silence_hangover": 0.5,
+    "min_speech_duration": 0.3,
+    "max_utterance_duration": 30,
+    "pre_roll": 0.3,
+    "min_energy": 300,
+    "speech_ratio": 3.0,
+    "segment_pause": 0.25,
+    "min_segment_duration": 2.0,
+}
+# Silence kept at the end of an utterance after the hangover is trimmed off
+TRAILING_SILENCE_SECONDS = 0.1
+UPLOAD_FORMATS = {
+    "wav": ("WAV", "PCM_16", "wav"),
+    "flac": ("FLAC", "PCM_16", "flac"),
+    "opus": ("OGG", "OPUS", "ogg"),
+}
+
+def get_capture_profile(config):
+    return config["audio_capture"]
+
+def get_endpointing_settings(config):
+    return config["endpointing"]
+
+def open_input_stream(audio, sample_rate, chunk_size, input_format):
+    # Not every device can capture at 16 kHz natively; fall back to 44.1 kHz
+    # and resample before upload instead
+    try:
+        return audio.open(format=input_format, channels=1, rate=sample_rate, input=True, frames_per_buffer=chunk_size), sample_rate
+    except (OSError, ValueError) as e:
+        logging.warning(f"Capture at {sample_rate} Hz failed ({e}), using {FALLBACK_SAMPLE_RATE} Hz")
+        return audio.open(format=input_format, channels=1, rate=FALLBACK_SAMPLE_RATE, input=True, frames_per_buffer=chunk_size), FALLBACK_SAMPLE_RATE
+
+def resample(samples, from_rate, to_rate):
+    # FFT resampling is band-limited, so downsampling does not alias
+    if from_rate == to_rate or len(samples) == 0:
+        return samples
+    count = max(1, int(round(len(samples) * to_rate / from_rate)))
+    spectrum = np.fft.rfft(samples.astype(np.float32))
+    resampled = np.fft.irfft(spectrum[:count // 2 + 1], count) * (count / len(samples))
+    return np.clip(np.round(resampled), -32768, 32767).astype(np.int16)
+
+def encode_wav(samples, sample_rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(samples.tobytes())
+    return buffer
+
+def encode_speech(samples, sample_rate, profile):
+    # Returns an in-memory file named so the API can tell its format
+    upload_rate = profile["upload_sample_rate"]
+    samples = resample(samples, sample_rate, upload_rate)
+    audio_format = profile["upload_format"]
+    buffer = None
+    extension = "wav"
+    if audio_format != "wav" and audio_format in UPLOAD_FORMATS:
+        if soundfile is None:
+            logging.warning(f"soundfile is not installed, uploading WAV instead of {audio_format}")
+        else:
+            container, subtype, extension = UPLOAD_FORMATS[audio_format]
+            buffer = io.BytesIO()
+            try:
+                soundfile.write(buffer, samples, upload_rate, format=container, subtype=subtype)
+            except Exception as e:
+                logging.warning(f"Encoding {audio_format} failed ({e}), uploading WAV instead")
+                buffer = None
+                extension = "wav"
+    if buffer is None:
+        buffer = encode_wav(samples, upload_rate)
+    buffer.name = f"speech.{extension}"
+    buffer.seek(0)
+    return buffer
+
+class RingBuffer:
+    # Fixed-size int16 sample buffer. Memory is allocated once; when it is full
+    # the oldest samples are overwritten.
+
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.start = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def clear(self):
+        self.start = 0
+        self.length = 0
+
+    def write(self, samples):
+        samples = samples[-self.capacity:]
+        count = len(samples)
+        end = (self.start + self.length) % self.capacity
+        first = min(count, self.capacity - end)
+        self.buffer[end:end + first] = samples[:first]
+        self.buffer[:count - first] = samples[first:]
+        overflow = max(0, self.length + count - self.capacity)
+        self.start = (self.start + overflow) % self.capacity
+        self.length = min(self.capacity, self.length + count)
+
+    def read(self):
+        end = self.start + self.length
+        if end <= self.capacity:
+            return self.buffer[self.start:end].copy()
+        return np.concatenate((self.buffer[self.start:], self.buffer[:end - self.capacity]))
+
+class VoiceActivityDetector:
+    # Energy plus zero-crossing-rate detector, evaluated on short frames with
+    # NumPy. The energy threshold follows an adaptive noise floor, so the same
+    # settings work in a quiet office and next to a fan; frames with a very high
+    # zero-crossing rate (hiss, keyboard clicks) are not counted as speech.
+    #
+    # Noise loud enough to pass as speech (a hum, an air conditioner) would
+    # never be seen as non-speech, so the floor also rises slowly towards the
+    # quietest frame of the last noise_window seconds. Speech always has
+    # quieter gaps between words within that window; steady noise does not.
+
+    def __init__(self, sample_rate, frame_ms=20, min_threshold=300, speech_ratio=3.0,
+                 initial_noise_floor=150, noise_adapt_rate=0.05, max_zero_crossing_rate=0.35,
+                 min_speech_fraction=0.3, noise_window=2.0, noise_rise_rate=0.02):
+        self.frame_length = max(1, int(sample_rate * frame_ms / 1000))
+        self.recent_rms = deque(maxlen=max(1, int(noise_window * 1000 / frame_ms)))
+        self.noise_rise_rate = noise_rise_rate
+        self.min_threshold = min_threshold
+        self.speech_ratio = speech_ratio
+        self.noise_floor = initial_noise_floor
+        self.noise_adapt_rate = noise_adapt_rate
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+        self.min_speech_fraction = min_speech_fraction
+
+    def threshold(self):
+        return max(self.min_threshold, self.noise_floor * self.speech_ratio)
+
+    def speech_frames(self, samples):
+        count = len(samples) // self.frame_length
+        if count == 0:
+            return np.zeros(0, dtype=bool)
+        frames = samples[:count * self.frame_length].reshape(count, self.frame_length).astype(np.float32)
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        signs = np.signbit(frames)
+        zero_crossing_rate = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        speech = (rms > self.threshold()) & (zero_crossing_rate < self.max_zero_crossing_rate)
+        # Only non-speech frames move the noise floor
+        quiet = rms[~speech]
+        if quiet.size:
+            self.noise_floor += self.noise_adapt_rate * (float(quiet.mean()) - self.noise_floor)
+        self.recent_rms.extend(rms.tolist())
+        if len(self.recent_rms) == self.recent_rms.maxlen:
+            floor = min(self.recent_rms)
+            if floor > self.noise_floor:
+                # Once per chunk, so it takes a few seconds of steady noise to catch up
+                self.noise_floor += self.noise_rise_rate * len(rms) * (floor - self.noise_floor)
+        return speech
+
+    def is_speech(self, samples):
+        speech = self.speech_frames(samples)
+        return bool(speech.size) and bool(speech.mean() >= self.min_speech_fraction)
+
+class SpeechRecorder:
+    # Collects one utterance at a time into a preallocated ring buffer. A short
+    # pre-roll of the audio just before speech was detected is kept as well, so
+    # the first syllable is not clipped.
+
+    def __init__(self, sample_rate, pre_roll_seconds=0.3, max_seconds=60):
+        self.sample_rate = sample_rate
+        self.pre_roll = RingBuffer(max(1, int(sample_rate * pre_roll_seconds)))
+        self.utterance = RingBuffer(max(1, int(sample_rate * max_seconds)))
+        self.active = False
+
+    def feed(self, samples):
+        # Audio received while no utterance is in progress only fills the pre-roll
+        if self.active:
+            self.utterance.write(samples)
+        else:
+            self.pre_roll.write(samples)
+
+    def start(self):
+        self.utterance.clear()
+        self.utterance.write(self.pre_roll.read())
+        self.pre_roll.clear()
+        self.active = True
+
+    def finish(self):
+        samples = self.utterance.read()
+        self.utterance.clear()
+        self.active = False
+        return samples
+
+    def duration(self):
+        return len(self.utterance) / self.sample_rate
+
+
+class Endpointer:
+    # Splits a live stream into utterances. An utterance starts on the first
+    # speech chunk and ends once silence_hangover seconds of silence follow it,
+    # or is flushed when it reaches max_utterance_duration. Utterances with less
+    # than min_speech_duration of actual speech (coughs, clicks) are dropped.
+    # All durations are counted in samples, not wall-clock time.
+    #
+    # When on_segment is set, an utterance in progress is also cut at shorter
+    # pauses (segment_pause) once at least min_segment_duration has built up,
+    # so the pieces can be transcribed while the user is still talking. The
+    # final piece is handed over when the utterance ends.
+
+    def __init__(self, sample_rate, silence_hangover=0.5, min_speech_duration=0.3,
+                 max_utterance_duration=30, pre_roll=0.3, min_energy=300, speech_ratio=3.0,
+                 segment_pause=0.25, min_segment_duration=2.0, on_segment=None):
+        self.sample_rate = sample_rate
+        self.silence_hangover = silence_hangover
+        self.min_speech_duration = min_speech_duration
+        self.max_utterance_duration = max_utterance_duration
+        self.segment_pause = segment_pause
+        self.min_segment_duration = min_segment_duration
+        self.on_segment = on_segment
+        # Seconds of silence that ended the last utterance, i.e. how long endpointing took
+        self.trailing_silence = 0.0
+        self.vad = VoiceActivityDetector(sample_rate, min_threshold=min_energy, speech_ratio=speech_ratio)
+        # Room for the longest utterance plus its pre-roll and one hangover
+        self.recorder = SpeechRecorder(sample_rate, pre_roll, max_utterance_duration + pre_roll + silence_hangover + 1)
+        self.reset()
+
+    @classmethod
+    def from_config(cls, config, sample_rate, on_segment=None):
+        return cls(sample_rate, on_segment=on_segment, **get_endpointing_settings(config))
+
+    def configure(self, config):
+        # Applies new thresholds to a running endpointer. pre_roll and
+        # max_utterance_duration size the buffers, so they only change when
+        # the next endpointer is created.
+        settings = get_endpointing_settings(config)
+        self.silence_hangover = settings["silence_hangover"]
+        self.min_speech_duration = settings["min_speech_duration"]
+        self.segment_pause = settings["segment_pause"]
+        self.min_segment_duration = settings["min_segment_duration"]
+        self.vad.min_threshold = settings["min_energy"]
+        self.vad.speech_ratio = settings["speech_ratio"]
+
+    def reset(self):
+        self.speech_samples = 0
+        self.silence_samples = 0
+        self.segment_start = 0
+
+    def in_utterance(self):
+        return self.recorder.active
+
+    def has_speech(self):
+        # True once the utterance in progress holds enough speech to be kept
+        return self.recorder.active and self.speech_samples >= self.min_speech_duration * self.sample_rate
+
+    def process(self, samples):
+        # Returns the utterances completed by this chunk (usually none)
+        is_speech = self.vad.is_speech(samples)
+        if not self.recorder.active:
+            if not is_speech:
+                self.recorder.feed(samples)
+                return []
+            self.recorder.start()
+            self.reset()
+        self.recorder.feed(samples)
+        if is_speech:
+            self.speech_samples += len(samples)
+            self.silence_samples = 0
+        else:
+            self.silence_samples += len(samples)
+
+        if self.silence_samples >= self.silence_hangover * self.sample_rate:
+            return self.finish()
+        if self.recorder.duration() >= self.max_utterance_duration:
+            return self.finish()
+        if self.on_segment and self.silence_samples >= self.segment_pause * self.sample_rate:
+            self.cut_segment()
+        return []
+
+    def cut_segment(self):
+        utterance_length = len(self.recorder.utterance)
+        if utterance_length - self.segment_start < self.min_segment_duration * self.sample_rate:
+            return
+        # Cut in the middle of the pause, so neither side loses a word edge
+        cut = utterance_length - self.silence_samples // 2
+        self.on_segment(self.recorder.utterance.read()[self.segment_start:cut])
+        self.segment_start = cut
+
+    def flush(self):
+        # Hands over whatever is in progress, e.g. when recording is switched off
+        if not self.recorder.active:
+            return []
+        return self.finish()
+
+    def finish(self):
+        samples = self.recorder.finish()
+        trailing = max(0, self.silence_samples - int(TRAILING_SILENCE_SECONDS * self.sample_rate))
+        if trailing:
+            samples = samples[:len(samples) - trailing]
+        long_enough = self.speech_samples >= self.min_speech_duration * self.sample_rate
+        self.trailing_silence = self.silence_samples / self.sample_rate
+        if long_enough and self.on_segment and len(samples) > self.segment_start:
+            self.on_segment(samples[self.segment_start:])
+        self.reset()
+        return [samples] if long_enough else []
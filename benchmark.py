@@ -0,0 +1,330 @@
+# IConvo/benchmark.py
+
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+from PIL import Image, ImageOps
+from screen_capture import encode_screenshot
+from audio_recorder import Endpointer, encode_speech, encode_wav, DEFAULT_CAPTURE_PROFILE
+from mock_openai_server import MockOpenAIServer, MockSettings
+from app_config import parse_config
+
+SCREEN_SIZES = [(1920, 1080), (2560, 1440), (3840, 2160)]
+
+def synthetic_screenshot(size):
+    # Noise over a gradient gives the JPEG encoder realistic work to do without needing a display
+    noise = Image.effect_noise(size, 48)
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (noise, gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+
+def legacy_encode_screenshot(image, max_size, quality, image_path):
+    # The pipeline capture_screen used before: transpose, LANCZOS thumbnail, disk round-trip
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(max_size, Image.LANCZOS)
+    image.save(image_path, "JPEG", quality=quality)
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode("utf-8")
+
+def time_call(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None}
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95))}
+
+def format_ms(value):
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+def benchmark_screen_encoding(repeats=5, max_size=(1600, 1600), quality=90):
+    print("Screen capture encoding (median of {} runs)".format(repeats))
+    print(f"{'size':>11}  {'legacy ms':>10}  {'new ms':>8}  {'speedup':>7}  {'payload KB':>10}")
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        image_path = os.path.join(directory, "screenshot.jpeg")
+        for size in SCREEN_SIZES:
+            source = synthetic_screenshot(size)
+            legacy_time, _ = time_call(lambda: legacy_encode_screenshot(source.copy(), max_size, quality, image_path), repeats)
+            new_time, payload = time_call(lambda: encode_screenshot(source.copy(), max_size, quality), repeats)
+            print(f"{size[0]:>5}x{size[1]:<5}  {legacy_time * 1000:>10.1f}  {new_time * 1000:>8.1f}  {legacy_time / new_time:>6.2f}x  {len(payload) / 1024:>10.1f}")
+            results.append({"size": size, "legacy_seconds": legacy_time, "seconds": new_time, "payload_bytes": len(payload)})
+    return results
+
+def synthetic_speech(seconds, sample_rate=44100):
+    # A voiced-sounding signal: harmonics of a wandering pitch under a syllable-rate envelope, plus room noise
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    noise = np.random.default_rng(0).normal(0, 0.02, len(t))
+    return np.clip((voice * envelope * 0.25 + noise) * 32767, -32768, 32767).astype(np.int16)
+
+UPLOAD_PROFILES = [
+    ("wav 44.1 kHz (legacy)", None),
+    ("wav 16 kHz", {"upload_sample_rate": 16000, "upload_format": "wav"}),
+    ("flac 16 kHz", {"upload_sample_rate": 16000, "upload_format": "flac"}),
+    ("opus 16 kHz", {"upload_sample_rate": 16000, "upload_format": "opus"}),
+]
+
+def benchmark_upload_encoding(repeats=5, seconds=10):
+    print(f"Speech upload encoding ({seconds}s of synthetic speech captured at 44.1 kHz)")
+    print(f"{'profile':>22}  {'bytes/s':>9}  {'encode ms':>9}  {'file':>12}")
+    samples = synthetic_speech(seconds)
+    results = []
+    for name, profile in UPLOAD_PROFILES:
+        if profile is None:
+            encode = lambda: encode_wav(samples, 44100)
+        else:
+            encode = lambda: encode_speech(samples, 44100, profile)
+        encode_time, payload = time_call(encode, repeats)
+        size = payload.getbuffer().nbytes
+        print(f"{name:>22}  {size / seconds:>9.0f}  {encode_time * 1000:>9.1f}  {getattr(payload, 'name', 'speech.wav'):>12}")
+        results.append({"profile": name, "bytes_per_second": size / seconds, "encode_seconds": encode_time})
+    return results
+
+def synthetic_session(sample_rate=16000):
+    # (label, seconds, is_speech) segments: a short command, a sentence with
+    # natural pauses, a monologue past the utterance cap, and a click
+    segments = [
+        ("silence", 1.0, False), ("short command", 0.6, True), ("silence", 1.5, False),
+        ("sentence", 1.5, True), ("pause", 0.2, False), ("sentence", 1.5, True), ("silence", 1.0, False),
+        ("monologue", 40.0, True), ("silence", 1.0, False), ("click", 0.05, True), ("silence", 1.0, False),
+    ]
+    rng = np.random.default_rng(1)
+    speech = synthetic_speech(max(seconds for _, seconds, _ in segments), sample_rate)
+    parts, speech_ranges, position = [], [], 0
+    for label, seconds, is_speech in segments:
+        count = int(seconds * sample_rate)
+        if is_speech:
+            parts.append(speech[:count] if label != "click" else (rng.normal(0, 8000, count)).astype(np.int16))
+        else:
+            parts.append(rng.normal(0, 60, count).astype(np.int16))
+        if is_speech:
+            speech_ranges.append((position, position + count))
+        position += count
+    return np.concatenate(parts), speech_ranges
+
+def benchmark_endpointing(repeats=1, sample_rate=16000, chunk_size=1024):
+    # Runs the endpointing engine over synthetic PCM and reports how long after
+    # the end of speech each utterance was handed over
+    samples, speech_ranges = synthetic_session(sample_rate)
+    endpointer = Endpointer(sample_rate)
+    utterances = []
+    start = time.perf_counter()
+    for offset in range(0, len(samples), chunk_size):
+        for utterance in endpointer.process(samples[offset:offset + chunk_size]):
+            utterances.append((offset + chunk_size, len(utterance)))
+    elapsed = time.perf_counter() - start
+    print(f"Endpointing over {len(samples) / sample_rate:.1f}s of synthetic PCM ({elapsed * 1000:.1f} ms to process)")
+    print(f"{'handed over at s':>16}  {'length s':>8}  {'after speech end ms':>19}")
+    results = []
+    for emitted_at, length in utterances:
+        if any(start < emitted_at <= end for start, end in speech_ranges):
+            # Flushed by the utterance cap while speech was still going on
+            latency = None
+            print(f"{emitted_at / sample_rate:>16.2f}  {length / sample_rate:>8.2f}  {'cap flush':>19}")
+        else:
+            speech_end = max(end for _, end in speech_ranges if end <= emitted_at)
+            latency = (emitted_at - speech_end) / sample_rate
+            print(f"{emitted_at / sample_rate:>16.2f}  {length / sample_rate:>8.2f}  {latency * 1000:>19.0f}")
+        results.append({"emitted_at": emitted_at / sample_rate, "seconds": length / sample_rate, "latency_seconds": latency})
+    return results
+
+def mock_config(server, stream_responses=True):
+    # Every stage goes to the mock server through the local_server backend; caches are off
+    return parse_config({
+        "api_key": "mock",
+        "model": "mock-chat",
+        "whisper_model": "mock-whisper",
+        "tts_model": "mock-tts",
+        "tts_voice": "mock",
+        "max_response_tokens": 200,
+        "stream_responses": stream_responses,
+        "in_memory_audio": True,
+        "providers": {"chat": "local_server", "transcription": "local_server", "speech": "local_server"},
+        "local_server": {"base_url": server.base_url, "api_key": "mock"},
+        "tts_cache": {"enabled": False},
+        "response_cache": {"enabled": False},
+    })
+
+class RecordingPlayer:
+    # Stands in for AudioPlayer: notes when each clip would start playing
+    def __init__(self):
+        self.clips = []
+
+    def play(self, clip, on_done=None, on_start=None):
+        self.clips.append((time.perf_counter(), len(clip)))
+        if on_start:
+            on_start(clip)
+        if on_done:
+            on_done(clip)
+        return True
+
+    def interrupt(self):
+        return 0
+
+def benchmark_turns(repeats=5, settings=None):
+    # Full voice turns through the real providers and conversation engine against
+    # the mock server: upload speech, transcribe, stream the reply, synthesize
+    # each sentence and hand the clips to a (silent) player. Latencies are
+    # measured from the end of the user's speech.
+    from conversation_engine import ConversationEngine
+    from providers import get_transcriber
+
+    server = MockOpenAIServer(settings or MockSettings()).start()
+    speech_samples = synthetic_speech(3, DEFAULT_CAPTURE_PROFILE["sample_rate"])
+    results = []
+    try:
+        print(f"Voice turns against the mock server at {server.base_url} ({repeats} per mode)")
+        print(f"{'mode':>12}  {'first audio p50/p95 ms':>22}  {'turn p50/p95 ms':>16}  {'STT p50 ms':>10}  {'uploaded KB/turn':>16}")
+        for mode, stream_responses in (("streamed", True), ("whole reply", False)):
+            config = mock_config(server, stream_responses)
+            player = RecordingPlayer()
+            engine = ConversationEngine(player, lambda callback, *args: callback(*args))
+            engine.start()
+            transcriber = get_transcriber(config)
+            first_audio, turns, transcriptions = [], [], []
+            server.reset_stats()
+            try:
+                # The first turn is a warm-up (connections, tokenizer data) and is not counted
+                for index in range(repeats + 1):
+                    if index == 1:
+                        first_audio, turns, transcriptions = [], [], []
+                        server.reset_stats()
+                    player.clips.clear()
+                    done = threading.Event()
+                    replies = []
+                    start = time.perf_counter()
+                    speech = encode_speech(speech_samples, DEFAULT_CAPTURE_PROFILE["sample_rate"], DEFAULT_CAPTURE_PROFILE)
+                    text = transcriber.transcribe(speech)
+                    transcriptions.append(time.perf_counter() - start)
+                    messages = [{"role": "system", "content": "You are a benchmark."}, {"role": "user", "content": text or ""}]
+                    engine.start_turn(config, messages, lambda generation, token: None, lambda generation, reply: (replies.append(reply), done.set()))
+                    if not done.wait(60):
+                        raise RuntimeError(f"{mode} turn {index} timed out")
+                    # The engine reports a failed turn as a None reply
+                    if not replies[0] or not player.clips:
+                        raise RuntimeError(f"{mode} turn {index} failed (reply: {replies[0]!r}, {len(player.clips)} clips); see the log for the error")
+                    turns.append(time.perf_counter() - start)
+                    first_audio.append(player.clips[0][0] - start)
+            finally:
+                engine.close()
+            uploaded = sum(endpoint["bytes_received"] for endpoint in server.stats().values()) / repeats
+            first, turn = percentiles(first_audio), percentiles(turns)
+            print(f"{mode:>12}  {format_ms(first['p50']):>10} / {format_ms(first['p95']):<9}  {format_ms(turn['p50']):>7} / {format_ms(turn['p95']):<6}  "
+                  f"{format_ms(statistics.median(transcriptions)):>10}  {uploaded / 1024:>16.1f}")
+            results.append({
+                "mode": mode,
+                "time_to_first_audio_seconds": first,
+                "turn_latency_seconds": turn,
+                "transcription_seconds": percentiles(transcriptions),
+                "bytes_uploaded_per_turn": uploaded,
+                "requests": server.stats(),
+            })
+    finally:
+        server.stop()
+    return results
+
+def synthetic_video(path, seconds=10, fps=30, size=(1280, 720)):
+    import cv2
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    rng = np.random.default_rng(2)
+    for index in range(int(seconds * fps)):
+        if index % (fps * 3) == 0:
+            # A hard cut every three seconds, for the scene-change mode. Coarse
+            # blocks, so the cut survives downscaling to the scene signature.
+            blocks = rng.integers(0, 255, (9, 16, 3), dtype=np.uint8)
+            scene = cv2.resize(blocks, size, interpolation=cv2.INTER_LINEAR)
+        # Slow panning keeps the encoder and the decoder busy between cuts
+        writer.write(np.roll(scene, index * 2, axis=1))
+    writer.release()
+
+def benchmark_video(repeats=3, seconds=10):
+    # Frame sampling and encoding only; the synthetic clip has no audio track
+    from video_processing import process_video_and_transcribe
+    print(f"Video frame sampling ({seconds}s synthetic 720p clip, median of {repeats} runs)")
+    print(f"{'mode':>14}  {'ms':>8}  {'frames':>6}  {'payload KB':>10}")
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        video_path = os.path.join(directory, "video.mp4")
+        synthetic_video(video_path, seconds)
+        for mode, scene_threshold in (("every 2s", None), ("scene changes", 0.1)):
+            elapsed, (frames, _, _) = time_call(lambda: process_video_and_transcribe(video_path, None, scene_threshold=scene_threshold), repeats)
+            payload = sum(len(frame) for frame in frames)
+            print(f"{mode:>14}  {elapsed * 1000:>8.1f}  {len(frames):>6}  {payload / 1024:>10.1f}")
+            results.append({"mode": mode, "seconds": elapsed, "frames": len(frames), "payload_bytes": payload})
+    return results
+
+BENCHMARKS = {
+    "screen": benchmark_screen_encoding,
+    "upload": benchmark_upload_encoding,
+    "endpoint": benchmark_endpointing,
+    "video": benchmark_video,
+    "turn": benchmark_turns,
+}
+
+def run_benchmark(name, repeats, settings):
+    # Peak memory is the high-water mark of Python allocations (NumPy and Pillow buffers included) during the run
+    options = {"settings": settings} if name == "turn" else {}
+    tracemalloc.start()
+    try:
+        results = BENCHMARKS[name](repeats=repeats, **options)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    print(f"Peak memory: {peak / (1024 * 1024):.1f} MB")
+    return {"results": results, "peak_memory_bytes": peak}
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless IConvo benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock server: seconds before the first chat token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Mock server: seconds between streamed tokens")
+    parser.add_argument("--transcription-latency", type=float, default=0.3, help="Mock server: seconds per transcription")
+    parser.add_argument("--speech-latency", type=float, default=0.15, help="Mock server: seconds per speech request")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    settings = MockSettings(args.latency, args.token_delay, args.transcription_latency, args.speech_latency)
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": args.repeats,
+        "mock_server": vars(settings),
+        "benchmarks": {},
+    }
+    for name in args.benchmarks or BENCHMARKS:
+        try:
+            report["benchmarks"][name] = run_benchmark(name, args.repeats, settings)
+        except RuntimeError as e:
+            sys.exit(f"Benchmark {name} failed: {e}")
+        print()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,56 @@
 # IConvo/chat_function.py
 
 import openai
-import yaml
-import os
 import logging
+import nltk
+import base64
+import hashlib
+import io
+import math
+import queue
+import re
+import threading
+from collections import OrderedDict
+from PIL import Image
+from conversation_log import usage_fields
 
-def configure_openai(api_key):
-    return openai.OpenAI(api_key=api_key)
+# tiktoken is optional; without it token counts fall back to a character-based estimate
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Fixed costs from OpenAI's chat format: every message carries a few tokens of
+# framing and every reply is primed with a few more
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+LOW_DETAIL_IMAGE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+
+# Images that were already sent once are replaced by a small "low" detail copy
+STANDIN_IMAGE_SIZE = (512, 512)
+STANDIN_IMAGE_QUALITY = 60
+MAX_STANDIN_CACHE_SIZE = 32
+MAX_COMPACT_IMAGE_URL_LENGTH = 128 * 1024
+_standin_cache = OrderedDict()
+_standin_lock = threading.Lock()
+
+# A batch that could not be summarized is retried with the next one, or after this many seconds
+SUMMARY_RETRY_SECONDS = 30
+# After this many failed attempts in a row the waiting messages are dropped, and
+# at most this many wait at any time, so a backend that keeps failing is not
+# sent an ever larger transcript
+MAX_SUMMARY_ATTEMPTS = 3
+MAX_PENDING_SUMMARY_MESSAGES = 40
+SUMMARY_PROMPT = (
+    "You keep a running summary of a conversation between a user and an assistant. "
+    "Fold the new messages into the current summary. Keep names, facts, decisions, "
+    "preferences and open questions, and drop small talk. Reply with the updated summary only."
+)
+
+def log_usage(usage):
+    if usage:
+        logging.info(f"Tokens - Prompt: {usage.prompt_tokens}, Completion: {usage.completion_tokens}, Total: {usage.total_tokens}", extra=usage_fields(usage))
 
 def get_chat_response(client, messages, model, max_response_tokens):
     try:
@@ -15,47 +59,413 @@ def get_chat_response(client, messages, model, max_response_tokens):
             messages=messages,
             max_tokens=max_response_tokens
         )
+        log_usage(response.usage)
         return response
-    except openai.error.InvalidRequestError as e:
-        logging.error(f"Invalid request: {e}")
-        return None
-    except openai.error.AuthenticationError as e:
-        logging.error(f"Authentication error: {e}")
+    except openai.OpenAIError as e:
+        logging.error(f"OpenAI API error: {e}")
         return None
-    except openai.error.RateLimitError as e:
-        logging.error(f"Rate limit exceeded: {e}")
-        return None
-    except openai.error.APIConnectionError as e:
-        logging.error(f"API connection error: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error: {e}")
         return None
-    except openai.error.APIError as e:
-        logging.error(f"API error: {e}")
+
+def stream_chat_response(client, messages, model, max_response_tokens, on_finish=None):
+    # Yields the reply text piece by piece as the tokens arrive. on_finish gets
+    # the finish reason, so callers can tell a complete reply from a failed one.
+    try:
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_response_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            log_usage(getattr(chunk, "usage", None))
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+            if chunk.choices[0].finish_reason and on_finish:
+                on_finish(chunk.choices[0].finish_reason)
+    except openai.OpenAIError as e:
+        logging.error(f"OpenAI API error during streaming: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error during streaming: {e}")
+
+async def aget_chat_response(client, messages, model, max_response_tokens):
+    try:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_response_tokens
+        )
+        log_usage(response.usage)
+        return response
+    except openai.OpenAIError as e:
+        logging.error(f"OpenAI API error: {e}")
         return None
     except Exception as e:
         logging.error(f"Unexpected error: {e}")
         return None
 
-def load_config(config_file="config.yaml"):
-    if not os.path.exists(config_file):
-        raise FileNotFoundError(f"The configuration file '{config_file}' does not exist.")
-    with open(config_file, 'r', encoding='utf-8') as file:
-        config = yaml.safe_load(file)
-    return config
+async def astream_chat_response(client, messages, model, max_response_tokens, on_finish=None):
+    # Async counterpart of stream_chat_response. Cancelling the consumer closes
+    # the HTTP stream, so the server stops generating (and billing) right away.
+    stream = None
+    try:
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_response_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            log_usage(getattr(chunk, "usage", None))
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+            if chunk.choices[0].finish_reason and on_finish:
+                on_finish(chunk.choices[0].finish_reason)
+    except openai.OpenAIError as e:
+        logging.error(f"OpenAI API error during streaming: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error during streaming: {e}")
+    finally:
+        if stream is not None:
+            await stream.close()
+
+class OpenAIChat:
+    # Chat completions through the OpenAI API, or through a local server that
+    # speaks the same API. The a-prefixed methods use the async client.
+
+    def __init__(self, client, model, async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+
+    def complete(self, messages, max_response_tokens, model=None):
+        return get_chat_response(self.client, messages, model or self.model, max_response_tokens)
+
+    def stream(self, messages, max_response_tokens, model=None, on_finish=None):
+        return stream_chat_response(self.client, messages, model or self.model, max_response_tokens, on_finish)
+
+    async def acomplete(self, messages, max_response_tokens, model=None):
+        return await aget_chat_response(self.async_client, messages, model or self.model, max_response_tokens)
+
+    def astream(self, messages, max_response_tokens, model=None, on_finish=None):
+        return astream_chat_response(self.async_client, messages, model or self.model, max_response_tokens, on_finish)
+
+# Used when the punkt tokenizer data is not installed: a sentence ends at
+# ., ! or ? followed by whitespace
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_punkt_missing = False
+
+def split_sentences(text):
+    global _punkt_missing
+    if not _punkt_missing:
+        try:
+            return nltk.sent_tokenize(text)
+        except LookupError as e:
+            _punkt_missing = True
+            logging.warning(f"punkt tokenizer data unavailable, splitting sentences on punctuation: {e}")
+    return [sentence for sentence in SENTENCE_END.split(text.strip()) if sentence]
 
-def setup_logging(log_file):
-    logging.basicConfig(
-        filename=log_file,
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+class SentenceSplitter:
+    # Groups a token stream into complete sentences so each one can be spoken
+    # as soon as it is finished. The last sentence in the buffer is held back
+    # until more text arrives because punkt cannot know it is complete yet.
 
-def trim_history(messages, max_length):
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, token):
+        self.buffer += token
+        if not any(mark in self.buffer for mark in ".!?\n"):
+            return []
+        sentences = split_sentences(self.buffer)
+        if len(sentences) < 2:
+            return []
+        tail_start = self.buffer.rfind(sentences[-1])
+        self.buffer = self.buffer[tail_start:] if tail_start >= 0 else sentences[-1]
+        return sentences[:-1]
+
+    def flush(self):
+        rest = self.buffer.strip()
+        self.buffer = ""
+        return [rest] if rest else []
+
+def iter_sentences(tokens):
+    splitter = SentenceSplitter()
+    for token in tokens:
+        yield from splitter.feed(token)
+    yield from splitter.flush()
+
+def trim_history(messages, max_length, on_evict=None):
     if len(messages) > max_length:
+        if on_evict:
+            on_evict(messages[1:-(max_length-1)])
         messages = messages[:1] + messages[-(max_length-1):]
     return messages
 
-def get_num_tokens(text):
+def get_encoding(model=None):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("o200k_base")
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logging.warning(f"Local tokenizer unavailable, estimating token counts: {e}")
+        return None
+
+def get_num_tokens(text, encoding=None):
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
     # Rough estimate of the number of tokens in a text string
-    words = text.split()
-    return len(words)
\ No newline at end of file
+    return max(len(text.split()), math.ceil(len(text) / 4))
+
+def get_image_dimensions(url):
+    # Only the image header is parsed, the pixels are never decoded
+    if not url.startswith("data:"):
+        return None
+    try:
+        raw = base64.b64decode(url.split(",", 1)[1])
+        with Image.open(io.BytesIO(raw)) as image:
+            return image.size
+    except Exception:
+        return None
+
+def get_image_tokens(image_url):
+    if image_url.get("detail") == "low":
+        return LOW_DETAIL_IMAGE_TOKENS
+    size = get_image_dimensions(image_url.get("url", ""))
+    if size is None:
+        # Unknown size: assume a 1024x1024 image
+        size = (1024, 1024)
+    width, height = size
+    # High detail images are fitted into 2048x2048, then scaled so the short side is at most 768,
+    # and billed per 512px tile
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return LOW_DETAIL_IMAGE_TOKENS + IMAGE_TILE_TOKENS * tiles
+
+def get_message_tokens(message, encoding=None):
+    tokens = TOKENS_PER_MESSAGE + get_num_tokens(message.get("role", ""), encoding)
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return tokens + get_num_tokens(content, encoding)
+    for part in content:
+        if isinstance(part, str):
+            tokens += get_num_tokens(part, encoding)
+        elif part.get("type") == "text":
+            tokens += get_num_tokens(part.get("text", ""), encoding)
+        elif part.get("type") == "image_url":
+            tokens += get_image_tokens(part.get("image_url", {}))
+    return tokens
+
+def get_image_standin(url):
+    # Stand-ins are computed once per image and cached by content hash
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    with _standin_lock:
+        if key in _standin_cache:
+            _standin_cache.move_to_end(key)
+            return _standin_cache[key]
+    raw = base64.b64decode(url.split(",", 1)[1])
+    with Image.open(io.BytesIO(raw)) as image:
+        image.draft("RGB", STANDIN_IMAGE_SIZE)
+        image = image.convert("RGB")
+        image.thumbnail(STANDIN_IMAGE_SIZE, Image.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=STANDIN_IMAGE_QUALITY)
+    standin = f"data:image/jpeg;base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+    with _standin_lock:
+        _standin_cache[key] = standin
+        while len(_standin_cache) > MAX_STANDIN_CACHE_SIZE:
+            _standin_cache.popitem(last=False)
+    return standin
+
+def is_compact_image(image_url):
+    return image_url.get("detail") == "low" and len(image_url.get("url", "")) <= MAX_COMPACT_IMAGE_URL_LENGTH
+
+def compact_message_images(message):
+    # Swaps full-size images for their low detail stand-ins; returns True if anything changed
+    content = message.get("content")
+    if not content or isinstance(content, str):
+        return False
+    compacted = []
+    changed = False
+    for part in content:
+        if isinstance(part, dict) and part.get("type") == "image_url" and not is_compact_image(part.get("image_url", {})):
+            url = part["image_url"].get("url", "")
+            try:
+                standin = get_image_standin(url) if url.startswith("data:") else url
+            except Exception as e:
+                logging.warning(f"Could not create image stand-in: {e}")
+                standin = None
+            if standin:
+                part = {"type": "image_url", "image_url": {"url": standin, "detail": "low"}}
+                changed = True
+        compacted.append(part)
+    if changed:
+        message["content"] = compacted
+    return changed
+
+class TokenBudget:
+    # Trims a history list in place to a token budget. Each message is counted
+    # once, when it is first seen, and the running total is kept up to date as
+    # messages are evicted, so a turn only pays for the messages added since the
+    # previous one. The history must only grow by appending between calls.
+
+    def __init__(self, max_tokens, model=None):
+        self.max_tokens = max_tokens
+        self.model = model
+        self.encoding = get_encoding(model)
+        self.message_tokens = []
+        self.total_tokens = TOKENS_PER_REPLY
+
+    def count_new_messages(self, messages):
+        for message in messages[len(self.message_tokens):]:
+            tokens = get_message_tokens(message, self.encoding)
+            self.message_tokens.append(tokens)
+            self.total_tokens += tokens
+
+    def recount(self, messages, message):
+        # Called when a message already in the history was changed in place
+        for index in range(min(len(messages), len(self.message_tokens))):
+            if messages[index] is message:
+                tokens = get_message_tokens(message, self.encoding)
+                self.total_tokens += tokens - self.message_tokens[index]
+                self.message_tokens[index] = tokens
+                return
+
+    def trim(self, messages, on_evict=None, reserved_tokens=0):
+        self.count_new_messages(messages)
+        # Keep the system prompt and the latest message no matter what
+        drop = 0
+        while self.total_tokens + reserved_tokens > self.max_tokens and len(messages) - drop > 2:
+            drop += 1
+            self.total_tokens -= self.message_tokens[drop]
+        if drop:
+            if on_evict:
+                on_evict(messages[1:drop + 1])
+            del messages[1:drop + 1]
+            del self.message_tokens[1:drop + 1]
+        return messages
+
+
+def format_transcript(messages):
+    lines = []
+    for message in messages:
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            parts = []
+            for part in content:
+                if isinstance(part, str):
+                    parts.append(part)
+                elif part.get("type") == "text":
+                    parts.append(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    parts.append("[image]")
+            content = " ".join(parts)
+        lines.append(f"{message.get('role', 'user')}: {content}")
+    return "\n".join(lines)
+
+class HistorySummarizer:
+    # Folds messages evicted from the history into one "conversation so far"
+    # message. Summaries are produced on a worker thread, so trimming never
+    # waits on the extra request; until a batch is folded in, the previous
+    # summary is used. A failed request keeps its messages for the next try.
+
+    def __init__(self, chat, model, max_summary_tokens=300, summary=""):
+        # chat is a chat provider (see providers.py); model names the summary model on that backend
+        self.chat = chat
+        self.model = model
+        self.max_summary_tokens = max_summary_tokens
+        self.summary = summary
+        self.lock = threading.Lock()
+        self.evicted = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, messages):
+        if messages:
+            self.evicted.put(list(messages))
+
+    def stop(self):
+        # Ends the worker thread once the current request is done; returns the summary so far
+        self.evicted.put(None)
+        with self.lock:
+            return self.summary
+
+    def run(self):
+        pending = []
+        attempts = 0
+        while True:
+            batches = []
+            try:
+                batches.append(self.evicted.get(timeout=SUMMARY_RETRY_SECONDS if pending else None))
+            except queue.Empty:
+                pass
+            # Fold every batch that piled up while the previous request was running into one call
+            while True:
+                try:
+                    batches.append(self.evicted.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batches:
+                return
+            for batch in batches:
+                pending.extend(batch)
+            if len(pending) > MAX_PENDING_SUMMARY_MESSAGES:
+                logging.warning(f"Dropping {len(pending) - MAX_PENDING_SUMMARY_MESSAGES} old messages that could not be summarized")
+                del pending[:-MAX_PENDING_SUMMARY_MESSAGES]
+            try:
+                folded = self.fold(pending)
+            except Exception as e:
+                logging.error(f"Summarizing the conversation failed: {e}")
+                folded = False
+            attempts = 0 if folded else attempts + 1
+            if folded:
+                pending = []
+            elif attempts >= MAX_SUMMARY_ATTEMPTS:
+                logging.error(f"Conversation summary not updated after {attempts} attempts, {len(pending)} messages dropped")
+                pending = []
+                attempts = 0
+            else:
+                logging.warning(f"Conversation summary not updated, {len(pending)} messages kept for a retry")
+
+    def fold(self, messages):
+        # Returns True once the messages are part of the summary
+        with self.lock:
+            current_summary = self.summary
+        request = [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Current summary:\n{current_summary or '(empty)'}\n\nNew messages:\n{format_transcript(messages)}"}
+        ]
+        response = self.chat.complete(request, self.max_summary_tokens, self.model)
+        if not response:
+            return False
+        with self.lock:
+            self.summary = response.choices[0].message.content.strip()
+        logging.info(f"Conversation summary updated ({len(messages)} messages folded in)")
+        return True
+
+    def get_summary_message(self):
+        with self.lock:
+            if not self.summary:
+                return None
+            return {"role": "system", "content": f"Summary of the conversation so far:\n{self.summary}"}
+
+    def with_summary(self, messages):
+        # The summary goes right after the system prompt; the stored history itself is not modified
+        summary_message = self.get_summary_message()
+        if summary_message is None:
+            return messages
+        return messages[:1] + [summary_message] + messages[1:]
\ No newline at end of file
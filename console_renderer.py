@@ -0,0 +1,87 @@
+# IConvo/console_renderer.py
+
+import tkinter as tk
+
+# Roughly one display frame; writes arriving within it become a single insert
+FRAME_INTERVAL_MS = 16
+DEFAULT_SCROLLBACK_LINES = 5000
+# Trimming removes this share of the scrollback at once, so it happens rarely
+TRIM_SLACK = 0.1
+
+class ConsoleRenderer:
+    # Batches writes to a read-only Text widget. Writes are queued and applied
+    # once per frame with after(): consecutive inserts go in as one insert
+    # call, the widget is unlocked and scrolled once, and tags are configured
+    # the first time a color is used. The oldest lines are dropped beyond the
+    # scrollback limit. The view only follows new text while it is scrolled to
+    # the bottom, so reading back is not interrupted. Tk thread only.
+
+    def __init__(self, widget, scrollback_lines=DEFAULT_SCROLLBACK_LINES, interval_ms=FRAME_INTERVAL_MS):
+        self.widget = widget
+        self.scrollback_lines = scrollback_lines
+        self.interval_ms = interval_ms
+        self.tags = set()
+        # ("insert", text, tag) and ("clear", tag) operations, applied in order
+        self.pending = []
+        self.scheduled = None
+
+    def tag(self, name, foreground=None):
+        if name not in self.tags:
+            self.widget.tag_configure(name, foreground=foreground or name)
+            self.tags.add(name)
+        return name
+
+    def write(self, text, tag="black", foreground=None):
+        if text:
+            self.queue(("insert", text, self.tag(tag, foreground)))
+
+    def clear(self, tag):
+        # Removes all text with the given tag, e.g. a provisional transcript
+        self.queue(("clear", tag))
+
+    def queue(self, operation):
+        self.pending.append(operation)
+        if self.scheduled is None:
+            self.scheduled = self.widget.after(self.interval_ms, self.flush)
+
+    def flush(self):
+        self.scheduled = None
+        if not self.pending:
+            return
+        operations, self.pending = self.pending, []
+        follow = self.widget.yview()[1] >= 1.0
+        self.widget.config(state='normal')
+        inserts = []
+        for operation in operations:
+            if operation[0] == "insert":
+                inserts.extend(operation[1:])
+                continue
+            self.insert(inserts)
+            inserts = []
+            # The tag may cover separate runs; delete each one, last first so earlier indices stay valid
+            ranges = self.widget.tag_ranges(operation[1])
+            for start, end in reversed(list(zip(ranges[0::2], ranges[1::2]))):
+                self.widget.delete(start, end)
+        self.insert(inserts)
+        self.trim()
+        self.widget.config(state='disabled')
+        if follow:
+            self.widget.see(tk.END)
+
+    def insert(self, inserts):
+        # Text.insert takes any number of text, tag pairs
+        if inserts:
+            self.widget.insert(tk.END, *inserts)
+
+    def trim(self):
+        if not self.scrollback_lines:
+            return
+        lines = int(self.widget.index("end-1c").split(".")[0])
+        if lines > self.scrollback_lines:
+            keep = int(self.scrollback_lines * (1 - TRIM_SLACK))
+            self.widget.delete("1.0", f"{lines - keep + 1}.0")
+
+    def cancel(self):
+        if self.scheduled is not None:
+            self.widget.after_cancel(self.scheduled)
+            self.scheduled = None
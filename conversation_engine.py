@@ -0,0 +1,259 @@
+# IConvo/conversation_engine.py
+
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import os
+import threading
+import time
+from chat_function import SentenceSplitter
+from providers import get_chat_provider, get_transcriber, get_speech_provider
+from text_to_voice import save_speech
+from tracing import TurnTrace, current_turn_id
+
+def discard_clip(clip):
+    # Clips are MP3 bytes or, when in_memory_audio is off, a file under data/audio
+    if isinstance(clip, str) and os.path.isfile(clip):
+        try:
+            os.remove(clip)
+        except OSError as e:
+            logging.warning(f"Failed to delete discarded clip {clip}: {e}")
+
+class ConversationEngine:
+    # Runs the conversation pipeline on one asyncio event loop in a background
+    # thread. The stages are connected by queues:
+    #
+    #   capture -> speech queue -> STT -> (UI) -> LLM -> sentence queue -> TTS -> clip queue -> playback
+    #
+    # Capture stays on the recording thread and playback on the AudioPlayer
+    # thread; everything in between is a coroutine. A turn is one task whose
+    # stages are child tasks, so cancelling the turn aborts the open HTTP
+    # streams and drops whatever it still had queued. Results are never handed
+    # to the UI directly: they go through post(callback, *args), which the
+    # caller makes thread-safe. Each turn records its stages in a TurnTrace.
+
+    def __init__(self, audio_player, post):
+        self.audio_player = audio_player
+        self.post = post
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.speech_queue = None
+        self.transcription_worker = None
+        self.turn = None
+        # Every turn gets a generation ID; callbacks carry it so the UI can ignore stale turns
+        self.generations = itertools.count(1)
+        self.generation = 0
+        # Turns up to this generation were cancelled, possibly before they started
+        self.cancelled_generation = 0
+
+    def start(self):
+        self.thread.start()
+        self.call(self.start_workers()).result()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def call(self, coroutine):
+        # Schedules a coroutine on the engine loop from any thread
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def close(self):
+        if not self.loop.is_running():
+            return
+        try:
+            self.call(self.stop_workers()).result(timeout=2.0)
+        except (concurrent.futures.TimeoutError, RuntimeError) as e:
+            logging.warning(f"Conversation engine did not stop cleanly: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2.0)
+
+    async def start_workers(self):
+        self.speech_queue = asyncio.Queue()
+        self.transcription_worker = asyncio.create_task(self.transcribe_speech())
+
+    async def stop_workers(self):
+        tasks = [self.transcription_worker]
+        if self.turn:
+            tasks.append(self.turn)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Speech to text
+
+    def transcribe(self, config, speech, on_text, trace=None):
+        # Called from the recording thread; utterances are transcribed in the order they were spoken
+        self.loop.call_soon_threadsafe(self.speech_queue.put_nowait, (config, speech, on_text, trace or TurnTrace()))
+
+    async def transcribe_speech(self):
+        while True:
+            config, speech, on_text, trace = await self.speech_queue.get()
+            current_turn_id.set(trace.turn_id)
+            start_time = time.time()
+            transcriber = get_transcriber(config)
+            try:
+                with trace.span("stt", model=transcriber.model, bytes=speech.getbuffer().nbytes):
+                    text = await transcriber.atranscribe(speech)
+            except Exception as e:
+                logging.error(f"Transcription failed: {e}")
+                trace.finish("failed")
+                continue
+            logging.info(f"Transcription time: {time.time() - start_time:.2f} seconds")
+            self.post(on_text, text)
+
+    # Turns
+
+    def start_turn(self, config, messages, on_text, on_reply, on_clip_done=None, trace=None):
+        # messages must be a snapshot; the UI thread keeps ownership of the history.
+        # on_text(generation, text) gets the reply as it arrives and
+        # on_reply(generation, reply) the complete reply (None if it failed or was
+        # cancelled); on_clip_done(generation, clip) gets each clip once it has
+        # played, on the player thread. trace, if
+        # given, is the turn's TurnTrace; it is finished once playback ends.
+        # Starting a turn cancels the previous one. Returns the new turn's
+        # generation ID.
+        self.generation = generation = next(self.generations)
+        trace = trace or TurnTrace()
+        trace.generation = generation
+        self.call(self.replace_turn(generation, config, list(messages), on_text, on_reply, on_clip_done, trace))
+        return generation
+
+    def cancel_turn(self, generation=None):
+        # Cancels the running turn, or only the given generation if it is still running.
+        # Recorded straight away so a turn whose replace_turn has not run yet never starts
+        self.cancelled_generation = max(self.cancelled_generation, generation or self.generation)
+        return self.call(self.cancel_current_turn(generation))
+
+    async def cancel_current_turn(self, generation=None):
+        turn = self.turn
+        if turn and not turn.done() and generation in (None, turn.generation):
+            turn.cancel()
+            await asyncio.gather(turn, return_exceptions=True)
+
+    async def replace_turn(self, generation, config, messages, on_text, on_reply, on_clip_done, trace):
+        # Only one turn runs at a time
+        await self.cancel_current_turn()
+        if generation != self.generation or generation <= self.cancelled_generation:
+            trace.finish("cancelled")
+            return  # Cancelled, or a newer turn was requested, while this one was waiting to start
+        self.turn = asyncio.create_task(self.run_turn(generation, config, messages, on_text, on_reply, on_clip_done, trace))
+        self.turn.generation = generation
+
+    async def run_turn(self, generation, config, messages, on_text, on_reply, on_clip_done, trace):
+        # The turn is its own task, so this only tags its stages' log records
+        current_turn_id.set(trace.turn_id)
+        sentences = asyncio.Queue()
+        # Only a hand-over to play_clips; the audio player's own bounded queue is the playback buffer
+        clips = asyncio.Queue(maxsize=1)
+        stages = [
+            asyncio.create_task(self.generate_reply(generation, config, messages, sentences, on_text, trace)),
+            asyncio.create_task(self.synthesize_sentences(config, sentences, clips, trace)),
+            asyncio.create_task(self.play_clips(generation, clips, on_clip_done, trace)),
+        ]
+        try:
+            reply, _, _ = await asyncio.gather(*stages)
+        except asyncio.CancelledError:
+            await self.abort_stages(stages, clips)
+            logging.info(f"Turn {generation} cancelled")
+            trace.finish("cancelled")
+            self.post(on_reply, generation, None)
+            raise
+        except Exception as e:
+            logging.error(f"Turn {generation} failed: {e}")
+            await self.abort_stages(stages, clips)
+            trace.finish("failed")
+            reply = None
+        self.post(on_reply, generation, reply)
+
+    async def abort_stages(self, stages, clips):
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+        # Synthesized clips that never reached the player are dropped, files included
+        while not clips.empty():
+            discard_clip(clips.get_nowait())
+
+    async def generate_reply(self, generation, config, messages, sentences, on_text, trace):
+        chat = get_chat_provider(config)
+        max_response_tokens = config["max_response_tokens"]
+        stream = config["stream_responses"]
+        parts = []
+        try:
+            with trace.span("llm", model=chat.model, stream=stream) as span:
+                if stream:
+                    # Each sentence goes to text-to-speech as soon as it is complete
+                    splitter = SentenceSplitter()
+                    finish_reasons = []
+                    async for token in chat.astream(messages, max_response_tokens, on_finish=finish_reasons.append):
+                        if not parts:
+                            trace.mark("first_token")
+                        parts.append(token)
+                        self.post(on_text, generation, token)
+                        for sentence in splitter.feed(token):
+                            sentences.put_nowait(sentence)
+                    # The stream logs API and network errors and just ends; only a finish reason means the reply is complete
+                    if not finish_reasons:
+                        span["characters"] = sum(len(part) for part in parts)
+                        raise RuntimeError(f"Reply stream ended without a finish reason after {len(parts)} tokens")
+                    for sentence in splitter.flush():
+                        sentences.put_nowait(sentence)
+                else:
+                    response = await chat.acomplete(messages, max_response_tokens)
+                    trace.mark("first_token")
+                    if response:
+                        parts.append(response.choices[0].message.content)
+                        self.post(on_text, generation, parts[0])
+                        sentences.put_nowait(parts[0])
+                span["characters"] = sum(len(part) for part in parts)
+        finally:
+            sentences.put_nowait(None)
+        return "".join(parts) or None
+
+    async def synthesize_sentences(self, config, sentences, clips, trace):
+        speech = get_speech_provider(config)
+        audio_output_dir = os.path.join("data", "audio")
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                break
+            start_time = time.time()
+            try:
+                with trace.span("tts", characters=len(sentence)):
+                    # Cancelling the turn aborts this request mid-flight
+                    clip = await speech.asynthesize(sentence)
+                    if not config["in_memory_audio"]:
+                        clip = await asyncio.to_thread(save_speech, clip, audio_output_dir)
+            except Exception as e:
+                logging.error(f"Text-to-speech failed: {e}")
+                continue
+            logging.info(f"Text-to-speech time: {time.time() - start_time:.2f} seconds")
+            # Waits while the player's queue is full, so TTS stays only a clip or two ahead of it
+            try:
+                await clips.put(clip)
+            except asyncio.CancelledError:
+                discard_clip(clip)
+                raise
+        await clips.put(None)
+
+    async def play_clips(self, generation, clips, on_clip_done, trace):
+        def clip_done(clip):
+            # Runs on the player thread
+            if on_clip_done:
+                on_clip_done(generation, clip)
+            trace.clip_done()
+
+        try:
+            while True:
+                clip = await clips.get()
+                if clip is None:
+                    break
+                trace.clip_queued()
+                # AudioPlayer.play may block on its own bounded queue
+                await asyncio.to_thread(self.audio_player.play, clip, clip_done, trace.clip_started)
+            trace.all_clips_queued()
+        except asyncio.CancelledError:
+            # Stop what is already queued in the player too
+            await asyncio.to_thread(self.audio_player.interrupt)
+            raise
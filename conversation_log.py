@@ -0,0 +1,111 @@
+# IConvo/conversation_log.py
+
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from tracing import current_turn_id
+
+# The conversation log holds every message in full, so it is written off the
+# calling thread: log calls only put the record on a queue, and a
+# QueueListener thread does the file I/O. The file is rotated by size or by
+# time, rotated files can be gzipped, and "jsonl" writes one JSON object per
+# record with the role, turn ID and token usage where they apply.
+DEFAULT_CONVERSATION_LOG = {
+    "format": "text",
+    "rotation": "size",
+    "max_size_mb": 10,
+    "when": "midnight",
+    "backup_count": 5,
+    "compress": False,
+}
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Extra record attributes copied into JSONL records when they are set
+STRUCTURED_FIELDS = ("role", "turn_id", "usage")
+_listener = None
+
+def get_conversation_log_settings(config):
+    return config["conversation_log"]
+
+def usage_fields(usage):
+    # extra= for a log record about token usage
+    return {"usage": {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens, "total_tokens": usage.total_tokens}}
+
+class TurnIdFilter(logging.Filter):
+    # Tags records logged inside a turn with its ID. It runs on the calling
+    # thread, before the record is queued, so it sees the caller's context.
+    def filter(self, record):
+        if getattr(record, "turn_id", None) is None:
+            record.turn_id = current_turn_id.get()
+        return True
+
+class JsonlFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime(DATE_FORMAT, time.localtime(record.created)),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+def compress_rotated_file(source, dest):
+    with open(source, "rb") as source_file, gzip.open(dest, "wb") as dest_file:
+        shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
+def create_file_handler(log_file, settings):
+    # delay: the file is only opened on the first record, so a bad setting does not leave it open
+    if settings["rotation"] == "time":
+        handler = TimedRotatingFileHandler(log_file, when=settings["when"], backupCount=settings["backup_count"], encoding="utf-8", delay=True)
+    else:
+        handler = RotatingFileHandler(log_file, maxBytes=int(settings["max_size_mb"] * 1024 * 1024), backupCount=settings["backup_count"], encoding="utf-8", delay=True)
+    if settings["compress"]:
+        handler.namer = lambda name: f"{name}.gz"
+        handler.rotator = compress_rotated_file
+    if settings["format"] == "jsonl":
+        handler.setFormatter(JsonlFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT))
+    return handler
+
+def setup_logging(config):
+    # Routes the root logger through a queue to the rotating log file; call stop_logging() on exit.
+    # The file handler is built first: if the settings are invalid this raises
+    # and the logging set up before stays in place.
+    global _listener
+    log_file = config["log_file"]
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+    file_handler = create_file_handler(log_file, get_conversation_log_settings(config))
+    stop_logging()
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(TurnIdFilter())
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    if logger.hasHandlers():
+        logger.handlers.clear()
+    logger.addHandler(queue_handler)
+
+    _listener = QueueListener(log_queue, file_handler)
+    _listener.start()
+    return logger
+
+def stop_logging():
+    # Writes the records still queued and closes the file
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
@@ -3,66 +3,54 @@
 import logging
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, BooleanVar, StringVar, filedialog
-import yaml
-import openai
-from chat_function import get_chat_response, trim_history
-from main import capture_screen, encode_image
-from speech_to_text import transcribe_audio
-from text_to_voice import text_to_speech
-from video_processing import process_video
+from chat_function import trim_history, TokenBudget, HistorySummarizer, compact_message_images
+from screen_capture import capture_screen_base64
+from audio_player import AudioPlayer
+from yaml_highlighter import YamlHighlighter
+from console_renderer import ConsoleRenderer
+from audio_recorder import Endpointer, get_capture_profile, open_input_stream, encode_speech
+from openai_client import get_client_settings
+from app_config import ConfigStore, ConfigError, changed_keys
+from conversation_engine import ConversationEngine
+from providers import get_chat_provider, get_transcriber, prewarm_providers
+from speech_to_text import ChunkedTranscriber, stitch_transcripts
+from tts_cache import get_speech_cache
+from response_cache import CachedTranscriber
+from conversation_log import setup_logging, stop_logging
+from tracing import TurnTrace, get_trace_writer, get_tracing_settings, trace_event, close_trace_writers
+from video_processing import process_video_and_transcribe
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import pyaudio
-import wave
 import numpy as np
 import re
-import audioop
 import keyboard
 import os
 import time
 import queue
 import nltk
-import pygame
 import shutil
 import atexit
 from datetime import datetime
-from pygments import lex
-from pygments.lexers import YamlLexer
-from pygments.token import Token
+# Newer nltk releases read punkt_tab; older ones read punkt
 nltk.download('punkt')
+nltk.download('punkt_tab')
+
+# Upper bound for the last response kept in memory for "Save Audio"
+MAX_SAVED_AUDIO_BYTES = 16 * 1024 * 1024
+# Number of synthesized clips that may wait for playback before TTS pauses
+AUDIO_CLIP_BUFFER_SIZE = 8
+# How often the UI thread picks up results handed over by worker threads
+UI_EVENT_INTERVAL_MS = 15
+# How often config.yaml is checked for changes made outside the app
+CONFIG_CHECK_INTERVAL_MS = 1000
+# Segments of one utterance that may be transcribed at the same time
+CHUNKED_TRANSCRIPTION_WORKERS = 3
 
 # Function to get the current timestamp
 def get_timestamp():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-# Function to play audio and handle interruptions
-def play_audio(file_path, interrupt_flag):
-    pygame.mixer.init()
-    try:
-        pygame.mixer.music.load(file_path)
-        pygame.mixer.music.play()
-        print(f"{get_timestamp()} - Playing audio file: {file_path}")  # Debug print
-        while pygame.mixer.music.get_busy():
-            if interrupt_flag.is_set():
-                pygame.mixer.music.stop()
-                print(f"{get_timestamp()} - Playback interrupted: {file_path}")  # Debug print
-                break
-            time.sleep(0.1)
-    except pygame.error as e:
-        print(f"{get_timestamp()} - Error loading audio file: {e}")
-    finally:
-        pygame.mixer.quit()
-
-def is_audio_file_too_short(file_path, min_duration=0.75):
-    try:
-        with wave.open(file_path, 'r') as audio_file:
-            frames = audio_file.getnframes()
-            rate = audio_file.getframerate()
-            duration = frames / float(rate)
-            return duration < min_duration
-    except Exception as e:
-        print(f"{get_timestamp()} - Error checking audio file duration: {e}")
-        return True
-
 # Create a custom logging filter to ignore specific messages
 class IgnoreHttpRequestsFilter(logging.Filter):
     def filter(self, record):
@@ -96,26 +84,104 @@ class Application(tk.Tk):
         super().__init__()
         self.title("IConvo")
         self.geometry("800x600")
-        self.config = self.load_config()
+        # self.config is always a complete, validated snapshot; see apply_config
+        self.config_store = ConfigStore()
+        self.config = self.config_store.config
+        self.config_store.subscribe(self.apply_config)
         self.audio_queue = queue.Queue()
         self.recording = False
-        self.audio_playing = False
-        self.interrupt_flag = threading.Event()
-        self.audio_thread = None
-        self.current_audio_file = None
+        self.ui_events = queue.Queue()
+        self.audio_player = AudioPlayer(max_queued_clips=AUDIO_CLIP_BUFFER_SIZE)
+        self.audio_player.start()
+        self.engine = ConversationEngine(self.audio_player, self.post_to_ui)
+        self.engine.start()
         self.temp_audio_file = None
+        self.last_audio = None
+        # The turn in flight; see process_input and interrupt_turn
+        self.turn_active = False
+        self.turn_generation = 0
+        self.turn_id = None
+        self.turn_parts = []
+        self.turn_sent_messages = []
         self.messages = [{"role": "system", "content": self.config["system_prompt"]}]
+        self.token_budget = None
+        self.summarizer = None
+        self.previous_summary = ""
+        self.configure_history()
 
         self.colors = LIGHT_MODE
         self.create_widgets()
         self.configure_theme()
         self.setup_logging()
+        self.process_ui_events()
+        self.after(CONFIG_CHECK_INTERVAL_MS, self.watch_config)
+        if get_client_settings(self.config)["prewarm"]:
+            prewarm_providers(self.config)
         self.setup_keyboard_listener()
         self.create_temp_folder()
         self.clean_temp_folder()
         # Register the cleanup method to be called on exit
         atexit.register(self.cleanup_on_exit)
 
+    def configure_history(self):
+        # When a token budget is configured it replaces the message-count limit
+        max_history_tokens = self.config["max_history_tokens"]
+        if not max_history_tokens:
+            self.token_budget = None
+        elif self.token_budget and self.token_budget.model == self.config["model"]:
+            self.token_budget.max_tokens = max_history_tokens
+        else:
+            # A new budget counts the whole history again on the next turn
+            self.token_budget = TokenBudget(max_history_tokens, self.config["model"])
+        # Evicted messages are folded into a running summary instead of being dropped
+        if not self.config["summarize_history"]:
+            if self.summarizer:
+                # The summary is kept in case summarizing is switched back on
+                self.previous_summary = self.summarizer.stop()
+                self.summarizer = None
+            return
+        summary_model = self.config["summary_model"] or self.config["model"]
+        if self.summarizer is None:
+            self.summarizer = HistorySummarizer(get_chat_provider(self.config), summary_model, self.config["max_summary_tokens"], self.previous_summary)
+        else:
+            # The summary so far is kept
+            self.summarizer.chat = get_chat_provider(self.config)
+            self.summarizer.model = summary_model
+            self.summarizer.max_summary_tokens = self.config["max_summary_tokens"]
+
+    def apply_config(self, old, new):
+        # Called on the UI thread with the old and new snapshots. Providers, the
+        # client pools, the TTS voice, caches and tracing read the config on
+        # every call, so handing them the new snapshot is enough; the rest is
+        # reconfigured here. The recording thread picks up new VAD thresholds itself.
+        self.config = new
+        changed = changed_keys(old, new)
+        if changed & {"log_file", "conversation_log"}:
+            self.setup_logging()
+        if "system_prompt" in changed:
+            self.messages[0] = {"role": "system", "content": new["system_prompt"]}
+            if self.token_budget:
+                self.token_budget.recount(self.messages, self.messages[0])
+        if changed & {"model", "max_history_tokens", "summarize_history", "summary_model", "max_summary_tokens", "providers", "response_cache"}:
+            self.configure_history()
+        if "console_scrollback_lines" in changed:
+            self.console.scrollback_lines = new["console_scrollback_lines"]
+        if changed & {"api_key", "openai_client", "local_server", "providers", "faster_whisper"} and get_client_settings(new)["prewarm"]:
+            # Clients are rebuilt on first use after their settings change; do it now instead of mid-turn
+            prewarm_providers(new)
+        if changed:
+            self.write(f"Configuration applied: {', '.join(sorted(changed))}", "gray")
+
+    def watch_config(self):
+        # Picks up edits made to config.yaml outside the app
+        try:
+            if self.config_store.check() and self.config_text.get("1.0", "end-1c") == self.config_editor_text:
+                # The editor has no unsaved changes, so it follows the file
+                self.load_config_editor()
+        except (ConfigError, OSError) as e:
+            self.write(f"config.yaml was changed but not applied. {e}", "red")
+        self.after(CONFIG_CHECK_INTERVAL_MS, self.watch_config)
+
     def create_temp_folder(self):
         self.temp_folder = os.path.join("data", "temp")
         os.makedirs(self.temp_folder, exist_ok=True)
@@ -136,7 +202,14 @@ class Application(tk.Tk):
 
     def cleanup_on_exit(self):
         print(f"{get_timestamp()} - Cleaning up before exit...")
+        self.engine.close()
+        self.audio_player.close()
+        close_trace_writers()
+        speech_cache = get_speech_cache(self.config)
+        if speech_cache:
+            print(f"{get_timestamp()} - {speech_cache.describe_stats()}")
         self.clean_temp_folder()
+        stop_logging()
         print(f"{get_timestamp()} - Cleanup completed.")
 
     def create_widgets(self):
@@ -180,6 +253,7 @@ class Application(tk.Tk):
 
         self.console_output = scrolledtext.ScrolledText(console_frame, wrap=tk.WORD, state='disabled', bg=self.colors["output_bg"], fg=self.colors["output_fg"])
         self.console_output.pack(fill='both', expand=True, padx=5, pady=5)
+        self.console = ConsoleRenderer(self.console_output, self.config["console_scrollback_lines"])
 
         self.input_frame = ttk.Frame(console_frame, style="TFrame")
         self.input_frame.pack(fill='x', padx=5, pady=5)
@@ -204,40 +278,36 @@ class Application(tk.Tk):
         self.config_text.pack(fill=tk.BOTH, expand=True)
 
         # Load the configuration into the text editor
-        with open('config.yaml', 'r', encoding='utf-8') as file:
-            config_data = file.read()
-            self.config_text.insert(tk.END, config_data)
+        self.load_config_editor()
 
-        # Apply syntax highlighting
-        self.highlight_syntax()
-
-        # Configure tags for syntax highlighting
-        self.config_text.tag_configure("Token.Keyword", foreground="blue")
-        self.config_text.tag_configure("Token.Literal.Scalar", foreground="black")
-        self.config_text.tag_configure("Token.Literal.String", foreground="green")
-        self.config_text.tag_configure("Token.Literal.Number", foreground="purple")
-        self.config_text.tag_configure("Token.Comment", foreground="gray")
+        # Highlighting follows edits, re-lexing only the lines that changed
+        self.highlighter = YamlHighlighter(self.config_text)
 
         self.save_button = ttk.Button(config_frame, text="Save Config", command=self.save_config)
         self.save_button.pack(padx=5, pady=5)
 
-    def highlight_syntax(self):
-        self.config_text.mark_set("range_start", "1.0")
-        data = self.config_text.get("1.0", "end-1c")
-        for token, content in lex(data, YamlLexer()):
-            self.config_text.mark_set("range_end", "range_start + {}c".format(len(content)))
-            self.config_text.tag_add(str(token), "range_start", "range_end")
-            self.config_text.mark_set("range_start", "range_end")
+    def load_config_editor(self):
+        with open(self.config_store.path, 'r', encoding='utf-8') as file:
+            self.config_editor_text = file.read()
+        self.config_text.delete("1.0", tk.END)
+        self.config_text.insert(tk.END, self.config_editor_text)
 
     def save_config(self):
         # Get the modified configuration data from the text editor
         config_data = self.config_text.get("1.0", "end-1c")
 
-        # Save the modified configuration data to the config.yaml file
-        with open('config.yaml', 'w', encoding='utf-8') as file:
-            file.write(config_data)
+        # The file is only written if it is valid, and the new settings apply straight away
+        try:
+            self.config_store.save(config_data)
+        except ConfigError as e:
+            messagebox.showerror("Invalid configuration", str(e))
+            return
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not save the configuration: {e}")
+            return
+        self.config_editor_text = config_data
 
-        messagebox.showinfo("Info", "Configuration saved successfully.")
+        messagebox.showinfo("Info", "Configuration saved and applied.")
 
     def create_about_tab(self):
         about_frame = ttk.Frame(self.notebook)
@@ -261,27 +331,23 @@ class Application(tk.Tk):
         webbrowser.open_new(url)
 
     def setup_logging(self):
-        log_file = self.config["log_file"]  # Get the log file path from the config
+        # Log calls only queue the record; the file is written on a background thread
+        self.logger = setup_logging(self.config)
 
-        self.logger = logging.getLogger()
-        self.logger.setLevel(logging.INFO)
+    # Console output is batched by self.console and drawn once per frame
+    def write(self, message, color="black"):
+        self.console.write(message + '\n', color)
 
-        if self.logger.hasHandlers():
-            self.logger.handlers.clear()
+    def write_inline(self, text, color="black"):
+        self.console.write(text, color)
 
-        # Create a file handler for logging to a file
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setLevel(logging.INFO)
-        file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-        file_handler.setFormatter(file_formatter)
-        self.logger.addHandler(file_handler)
+    def show_partial_transcript(self, text):
+        # Provisional text is replaced in place each time more of the utterance is transcribed
+        self.clear_partial_transcript()
+        self.console.write(f"{self.config['user_name']} (...): {text}\n", "partial", foreground="gray")
 
-    def write(self, message, color="black"):
-        self.console_output.config(state='normal')
-        self.console_output.insert(tk.END, message + '\n', color)
-        self.console_output.tag_configure(color, foreground=color)
-        self.console_output.config(state='disabled')
-        self.console_output.see(tk.END)
+    def clear_partial_transcript(self):
+        self.console.clear("partial")
 
     def on_enter(self, event=None):
         user_input = self.input_box.get()
@@ -289,79 +355,158 @@ class Application(tk.Tk):
             self.input_box.delete(0, tk.END)
             self.process_input(user_input)
 
-    def process_input(self, user_input):
-        if self.audio_playing:
-            self.interrupt_flag.set()
-            self.audio_playing = False
-            if self.audio_thread is not None:
-                self.audio_thread.join(timeout=1.0)
-                self.clear_current_audio_file()  # Clear only the current audio file
-                time.sleep(0.5)  # Introduce a short delay to ensure the interruption is handled
-        self.write(f"{self.config['user_name']}: {user_input}", self.config['user_color'])
-        self.logger.info(f"{self.config['user_name']}: {user_input}")  # Log user input
+    def new_trace(self):
+        return TurnTrace(get_trace_writer(self.config), on_finish=lambda trace: self.post_to_ui(self.show_latency, trace))
+
+    def show_latency(self, trace):
+        if get_tracing_settings(self.config)["console_breakdown"]:
+            self.write(trace.describe(), "gray")
 
-        client = openai.OpenAI(api_key=self.config["api_key"])
+    def process_input(self, user_input, trace=None):
+        if self.turn_active or self.audio_player.is_playing():
+            self.interrupt_turn()
+        trace = trace or self.new_trace()
+        self.write(f"{self.config['user_name']}: {user_input}", self.config['user_color'])
+        self.logger.info(f"{self.config['user_name']}: {user_input}", extra={"role": "user", "turn_id": trace.turn_id})  # Log user input
 
         self.messages.append({"role": "user", "content": user_input})
 
-        model = self.config["model"]
-        max_response_tokens = int(self.config["max_response_tokens"])
-
-        self.messages = trim_history(self.messages, int(self.config["max_history_length"]))
-
-        def process_response():
-            response = get_chat_response(client, self.messages, model, max_response_tokens)
-            
-            if response:
-                assistant_response = response.choices[0].message.content
-                self.after(0, self.write, f"{self.config['assistant_name']}: {assistant_response}", self.config['assistant_color'])
-                self.logger.info(f"{self.config['assistant_name']}: {assistant_response}")  # Log assistant response
-                self.messages.append({"role": "assistant", "content": assistant_response})
-
-                audio_output_dir = os.path.join("data", "audio")
-                
-                start_time = time.time()  # Start the timer
-                audio_file_path = text_to_speech(self.config["api_key"], self.config["tts_model"], self.config["tts_voice"], assistant_response, audio_output_dir)
-                tts_time = time.time() - start_time  # Calculate the text-to-speech time
-                print(f"{get_timestamp()} - Text-to-speech time: {tts_time:.2f} seconds")
-                print(f"{get_timestamp()} - Audio saved to {audio_file_path}")  # Debug print
-
-                self.after(0, self.play_and_delete_audio, audio_file_path)
-
-        # Run the response processing on a separate thread
-        threading.Thread(target=process_response).start()
-
-    def play_and_delete_audio(self, file_path):
-        self.audio_playing = True
-        self.current_audio_file = file_path
-        self.temp_audio_file = os.path.join(self.temp_folder, os.path.basename(file_path))
-        shutil.copy2(file_path, self.temp_audio_file)
-        self.interrupt_flag.clear()
-
-        def audio_player():
+        on_evict = self.summarizer.submit if self.summarizer else None
+        if self.token_budget:
+            reserved_tokens = self.summarizer.max_summary_tokens if self.summarizer else 0
+            self.token_budget.trim(self.messages, on_evict, reserved_tokens)
+        else:
+            self.messages = trim_history(self.messages, self.config["max_history_length"], on_evict)
+
+        # Everything in the history at this point is about to be sent
+        sent_messages = list(self.messages)
+
+        # The reply is generated, spoken and played by the engine; the history is
+        # only ever modified here on the UI thread
+        self.temp_audio_file = os.path.join(self.temp_folder, f"response_{int(time.time() * 1000)}.mp3")
+        self.last_audio = None
+        self.write_inline(f"{self.config['assistant_name']}: ", self.config['assistant_color'])
+        self.turn_active = True
+        self.turn_id = trace.turn_id
+        self.turn_parts = []
+        self.turn_sent_messages = sent_messages
+        self.turn_generation = self.engine.start_turn(
+            self.config,
+            self.request_messages(),
+            on_text=self.receive_turn_text,
+            on_reply=self.receive_turn_reply,
+            on_clip_done=lambda generation, clip: self.post_to_ui(self.keep_streamed_clip, generation, clip),
+            trace=trace
+        )
+
+    def is_current_turn(self, generation):
+        # Events from a turn that was interrupted or has already finished are ignored
+        return self.turn_active and generation == self.turn_generation
+
+    def receive_turn_text(self, generation, text):
+        if self.is_current_turn(generation):
+            self.turn_parts.append(text)
+            self.write_inline(text, self.config['assistant_color'])
+
+    def receive_turn_reply(self, generation, assistant_response):
+        if self.is_current_turn(generation):
+            if assistant_response is None and self.turn_parts:
+                # The reply was cut off; what was already shown is kept, marked as interrupted
+                self.finish_turn("".join(self.turn_parts), interrupted=True)
+            else:
+                self.finish_turn(assistant_response)
+
+    def finish_turn(self, assistant_response, interrupted=False):
+        self.turn_active = False
+        self.write_inline(" [interrupted]\n" if interrupted else "\n", self.config['assistant_color'])
+        if assistant_response:
+            # Only a request that got a reply has shown the model its images in full
+            self.compact_sent_images(self.turn_sent_messages)
+            # An interrupted reply is kept as far as it got, so the history still alternates
+            # and the model knows what the user has already heard
+            suffix = " (interrupted)" if interrupted else ""
+            self.logger.info(f"{self.config['assistant_name']}{suffix}: {assistant_response}", extra={"role": "assistant", "turn_id": self.turn_id})  # Log assistant response
+            self.messages.append({"role": "assistant", "content": assistant_response})
+
+    def compact_sent_images(self, sent_messages):
+        # Images are sent in full only once; afterwards the history keeps a small stand-in
+        if not self.config["compact_sent_images"]:
+            return
+        for message in sent_messages:
+            if compact_message_images(message) and self.token_budget:
+                self.token_budget.recount(self.messages, message)
+
+    def request_messages(self):
+        if self.summarizer:
+            return self.summarizer.with_summary(self.messages)
+        return self.messages
+
+    def post_to_ui(self, callback, *args):
+        # Thread-safe hand-off: worker threads and the engine never touch Tk themselves
+        self.ui_events.put((callback, args))
+
+    def process_ui_events(self):
+        while True:
             try:
-                play_audio(file_path, self.interrupt_flag)
-                print(f"{get_timestamp()} - Completed playing audio file: {file_path}")
-            finally:
-                self.audio_playing = False
-                time.sleep(0.5)
-                self.clear_current_audio_file()
-
-        self.audio_thread = threading.Thread(target=audio_player)
-        self.audio_thread.start()
-
-    def clear_current_audio_file(self):
-        if self.current_audio_file and os.path.isfile(self.current_audio_file):
+                callback, args = self.ui_events.get_nowait()
+            except queue.Empty:
+                break
             try:
-                os.remove(self.current_audio_file)
-                print(f"{get_timestamp()} - Deleted audio file: {self.current_audio_file}")
+                callback(*args)
             except Exception as e:
-                print(f"{get_timestamp()} - Failed to delete {self.current_audio_file}. Reason: {e}")
-            finally:
-                self.current_audio_file = None
+                logging.error(f"UI callback {callback} failed: {e}")
+        self.after(UI_EVENT_INTERVAL_MS, self.process_ui_events)
+
+    def keep_streamed_clip(self, generation, clip):
+        # MP3 frames can be concatenated, so the whole reply stays available to "Save Audio".
+        # Clips of an earlier turn that finish playing after a new turn has started are dropped.
+        current = generation == self.turn_generation
+        if isinstance(clip, (bytes, bytearray)):
+            if current:
+                self.keep_last_audio(clip, append=True)
+            return
+        try:
+            if current:
+                with open(clip, "rb") as clip_file, open(self.temp_audio_file, "ab") as combined:
+                    shutil.copyfileobj(clip_file, combined)
+            os.remove(clip)
+        except Exception as e:
+            print(f"{get_timestamp()} - Failed to keep audio clip {clip}. Reason: {e}")
+
+    def keep_last_audio(self, audio_bytes, append=False):
+        # Only the most recent response is kept, and never more than MAX_SAVED_AUDIO_BYTES
+        if append and self.last_audio is not None:
+            if len(self.last_audio) + len(audio_bytes) <= MAX_SAVED_AUDIO_BYTES:
+                self.last_audio.extend(audio_bytes)
+            return
+        self.last_audio = bytearray(audio_bytes[:MAX_SAVED_AUDIO_BYTES])
+
+    def interrupt_turn(self):
+        # Barge-in: settle the history first, then cancel the turn in flight (its
+        # HTTP streams and queued speech) and flush playback
+        if self.turn_active:
+            self.finish_turn("".join(self.turn_parts), interrupted=True)
+            self.engine.cancel_turn(self.turn_generation)
+        flushed = self.audio_player.interrupt()
+        print(f"{get_timestamp()} - Turn interrupted, {flushed} queued clip(s) dropped")
+
+    def barge_in(self):
+        # The user started talking over the assistant
+        if self.turn_active or self.audio_player.is_playing():
+            self.interrupt_turn()
 
     def save_last_audio(self):
-        if self.temp_audio_file and os.path.isfile(self.temp_audio_file):
+        if self.last_audio:
+            save_path = filedialog.asksaveasfilename(
+                defaultextension=".mp3",
+                filetypes=[("MP3 files", "*.mp3")],
+                title="Save Last Audio Response"
+            )
+            if save_path:
+                with open(save_path, "wb") as audio_file:
+                    audio_file.write(self.last_audio)
+                messagebox.showinfo("Success", f"Audio saved to {save_path}")
+        elif self.temp_audio_file and os.path.isfile(self.temp_audio_file):
             save_path = filedialog.asksaveasfilename(
                 defaultextension=".mp3",
                 filetypes=[("MP3 files", "*.mp3")],
@@ -375,9 +520,10 @@ class Application(tk.Tk):
 
     def clear_audio_directory(self):
         audio_output_dir = os.path.join("data", "audio")
-        for filename in os.listdir(audio_output_dir):
-            file_path = os.path.join(audio_output_dir, filename)
-            if file_path != self.current_audio_file:
+        # Clips that are still queued or playing are deleted by the player once they finish
+        if not self.audio_player.is_playing() and os.path.isdir(audio_output_dir):
+            for filename in os.listdir(audio_output_dir):
+                file_path = os.path.join(audio_output_dir, filename)
                 try:
                     if os.path.isfile(file_path):
                         os.remove(file_path)
@@ -426,27 +572,41 @@ class Application(tk.Tk):
         for command, keywords in self.config["commands"].items():
             if any(str(keyword).lower() in text.lower() for keyword in keywords):
                 if command == "image":
-                    try:
-                        print(f"{get_timestamp()} - Executing image capture command...")
-                        capture_screen(self.config["image_path"], self.config["image_max_size"], int(self.config["image_quality"]))
-                        base64_image = encode_image(self.config["image_path"])
-                        self.write(f"Image captured and saved to {self.config['image_path']}")
-                        self.messages.append({"role": "user", "content": [
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                        ]})
-                        self.process_input("")  # Trigger response processing with an empty input
-                        return True  # Command found and processed
-                    except Exception as e:
-                        print(f"{get_timestamp()} - Error capturing or encoding image: {e}")
-                        self.write(f"Error capturing or encoding image: {e}")
+                    print(f"{get_timestamp()} - Executing image capture command...")
+                    config = self.config
+
+                    def capture():
+                        # The grab and JPEG encode run off the UI thread
+                        try:
+                            base64_image = capture_screen_base64(config["image_max_size"], config["image_quality"], config["capture_area"])
+                        except Exception as e:
+                            print(f"{get_timestamp()} - Error capturing or encoding image: {e}")
+                            self.post_to_ui(self.write, f"Error capturing or encoding image: {e}")
+                            return
+                        self.post_to_ui(self.send_captured_image, base64_image)
+
+                    threading.Thread(target=capture, daemon=True).start()
+                    return True  # Command found and processed
                 elif command == "video":
-                    video_path = input("Enter the video file path: ")
-                    base64_frames, audio_path = process_video(video_path)
-                    transcribed_text = transcribe_audio(audio_path, openai.OpenAI(api_key=self.config["api_key"]))
-                    self.write("These are the frames from the video.")
-                    for frame in base64_frames:
-                        self.write(f'<img src="data:image/jpg;base64,{frame}" style="detail: low" />')
-                    self.write(f"The audio transcription is: {transcribed_text}")
+                    video_path = filedialog.askopenfilename(title="Select a video file")
+                    if not video_path:
+                        return True
+                    config = self.config
+
+                    def process_video():
+                        # Frame sampling and transcription take seconds; the UI only gets the results
+                        try:
+                            transcriber = get_transcriber(config)
+                            transcript_cache = transcriber if isinstance(transcriber, CachedTranscriber) else None
+                            base64_frames, audio_path, transcribed_text = process_video_and_transcribe(video_path, transcriber.transcribe, scene_threshold=config["video_scene_threshold"], transcript_cache=transcript_cache)
+                        except Exception as e:
+                            logging.error(f"Failed to process video {video_path}: {e}")
+                            self.post_to_ui(self.write, f"Error processing video: {e}")
+                            return
+                        self.post_to_ui(self.show_video, base64_frames, transcribed_text)
+
+                    self.write(f"Processing video {video_path}...")
+                    threading.Thread(target=process_video, daemon=True).start()
                     return True  # Command found and processed
                 elif command == "text":
                     additional_text = self.get_text_input()
@@ -457,82 +617,139 @@ class Application(tk.Tk):
                         self.process_input("")  # Trigger response processing with an empty input
                     return True  # Command found and processed
 
+    def send_captured_image(self, base64_image):
+        self.write("Image captured")
+        self.messages.append({"role": "user", "content": [
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+        ]})
+        self.process_input("")  # Trigger response processing with an empty input
+
+    def show_video(self, base64_frames, transcribed_text):
+        self.write("These are the frames from the video.")
+        for frame in base64_frames:
+            self.write(f'<img src="data:image/jpg;base64,{frame}" style="detail: low" />')
+        self.write(f"The audio transcription is: {transcribed_text}")
+
     def toggle_recording(self):
         self.recording = not self.recording
         self.toggle_button.config(bg="red" if self.recording else "green")
+        trace_event(self.config, "recording_start" if self.recording else "recording_stop")
         if self.recording:
             self.start_listening()
         else:
-            self.interrupt_flag.set()
+            self.interrupt_turn()
             self.clear_audio_directory()
 
     def start_listening(self):
-        self.interrupt_flag.clear()
         threading.Thread(target=self.listen_for_audio).start()
 
     def listen_for_audio(self):
-        audio_path = self.config["audio_path"]
-        fs = 44100
-        channels = 1
-        threshold = 500  # Adjust threshold as needed
-        min_silence_duration = 2  # Minimum duration of silence before stopping the recording
-        min_recording_duration = 3  # Minimum recording duration in seconds
+        profile = get_capture_profile(self.config)
+        chunk_size = 1024
 
         audio = pyaudio.PyAudio()
-        stream = audio.open(format=pyaudio.paInt16, channels=channels, rate=fs, input=True, frames_per_buffer=1024)
-
-        recording_frames = []
-        recording = False
-        silence_counter = 0
-        recording_start_time = None
-
+        stream, fs = open_input_stream(audio, profile["sample_rate"], chunk_size, pyaudio.paInt16)
+        transcriber = None
+        if self.config["chunked_transcription"]:
+            # Segments split at short pauses are transcribed while the user keeps talking
+            transcribe = get_transcriber(self.config).transcribe
+            # Segments are encoded on the worker pool too, not on this thread
+            transcriber = ChunkedTranscriber(
+                lambda segment: transcribe(encode_speech(segment, fs, profile)),
+                max_workers=CHUNKED_TRANSCRIPTION_WORKERS,
+                on_partial=lambda text: self.post_to_ui(self.show_partial_transcript, text)
+            )
+            endpointer = Endpointer.from_config(self.config, fs, on_segment=transcriber.submit)
+        else:
+            endpointer = Endpointer.from_config(self.config, fs)
+        # Whole utterances are encoded one at a time, in order, off this thread:
+        # this loop must keep reading, or PyAudio's input buffer overflows
+        encoder = ThreadPoolExecutor(max_workers=1)
+
+        speech_started = None
+
+        def handle_utterances(utterances):
+            nonlocal speech_started
+            for utterance in utterances:
+                # The turn's trace starts at the end of speech
+                trace = self.new_trace()
+                trace.add_span("speech", speech_started or trace.origin, trace.origin, audio_seconds=round(len(utterance) / fs, 2))
+                trace.add_span("vad_endpoint", trace.origin - endpointer.trailing_silence, trace.origin)
+                if transcriber:
+                    self.finish_chunked_utterance(transcriber, len(utterance) / fs, trace)
+                else:
+                    encoder.submit(self.submit_utterance, utterance, fs, profile, trace)
+            if not endpointer.in_utterance():
+                speech_started = None
+                if transcriber and not utterances:
+                    # The utterance was dropped as noise; so are its segments
+                    transcriber.discard()
+
+        config = self.config
+        barged_in = False
         while self.recording:
-            data = stream.read(1024)
-            rms = audioop.rms(data, 2)
-
-            if rms > threshold:
-                if not recording:
-                    recording_start_time = time.time()
-                    recording = True
-
-                recording_frames.append(data)
-                silence_counter = 0
-            elif recording:
-                silence_counter += 1
-                current_recording_duration = time.time() - recording_start_time
-                if silence_counter > (fs / 1024 * min_silence_duration) or (current_recording_duration >= min_recording_duration and current_recording_duration < min_recording_duration):
-                    recording = False
-
-                    wf = wave.open(audio_path, 'wb')
-                    wf.setnchannels(channels)
-                    wf.setsampwidth(audio.get_sample_size(pyaudio.paInt16))
-                    wf.setframerate(fs)
-                    wf.writeframes(b''.join(recording_frames))
-                    wf.close()
-                    print(f"{get_timestamp()} - Audio saved to {audio_path}")  # Debug print
-
-                    if current_recording_duration >= min_recording_duration and not is_audio_file_too_short(audio_path):
-                        self.after(0, self.process_transcription, audio_path)
-
-                    recording_frames = []
+            if self.config is not config:
+                # The config was reloaded; snapshots are immutable, so checking identity is enough
+                config = self.config
+                endpointer.configure(config)
+            # A late read drops audio instead of raising and ending the recording
+            samples = np.frombuffer(stream.read(chunk_size, exception_on_overflow=False), dtype=np.int16)
+            utterances = endpointer.process(samples)
+            if speech_started is None and endpointer.in_utterance():
+                speech_started = time.perf_counter() - len(samples) / fs
+            handle_utterances(utterances)
+            # Interrupt the assistant as soon as the user is clearly speaking, not when the transcript arrives
+            if config["barge_in"] and endpointer.has_speech():
+                if not barged_in:
+                    self.post_to_ui(self.barge_in)
+                    barged_in = True
+            else:
+                barged_in = False
+
+        # Whatever was still being said when recording was switched off is transcribed too
+        handle_utterances(endpointer.flush())
 
         stream.stop_stream()
         stream.close()
         audio.terminate()
-
-    def process_transcription(self, audio_path):
-        transcribed_text = transcribe_audio(audio_path, openai.OpenAI(api_key=self.config["api_key"]))
+        # Utterances already queued are still encoded and submitted
+        encoder.shutdown(wait=False)
+        if transcriber:
+            transcriber.shutdown()
+
+    def finish_chunked_utterance(self, transcriber, duration, trace):
+        segments = transcriber.take_segments()
+        print(f"{get_timestamp()} - Recorded {duration:.1f}s of audio in {len(segments)} segment(s)")  # Debug print
+
+        def stitch():
+            # Only segments still in flight are waited for; the others were transcribed while the user spoke
+            with trace.span("stt", segments=len(segments)):
+                transcribed_text = stitch_transcripts(segments)
+            self.post_to_ui(self.handle_transcribed_text, transcribed_text, trace)
+
+        threading.Thread(target=stitch, daemon=True).start()
+
+    def submit_utterance(self, samples, fs, profile, trace):
+        # Runs on the encoder thread. The upload is encoded in memory; nothing is written to disk
+        try:
+            with trace.span("encode", format=profile["upload_format"]):
+                speech = encode_speech(samples, fs, profile)
+        except Exception as e:
+            logging.error(f"Encoding the recorded audio failed: {e}")
+            trace.finish("failed")
+            return
+        print(f"{get_timestamp()} - Recorded {len(samples) / fs:.1f}s of audio, {speech.getbuffer().nbytes} bytes to upload")  # Debug print
+        # Transcribed on the engine loop; the text comes back on the UI thread
+        self.engine.transcribe(self.config, speech, lambda text: self.handle_transcribed_text(text, trace), trace)
+
+    def handle_transcribed_text(self, transcribed_text, trace=None):
+        self.clear_partial_transcript()
         if transcribed_text and self.is_valid_transcription(transcribed_text):
-            if self.audio_playing:
-                self.interrupt_flag.set()
-                self.audio_playing = False
-                if self.audio_thread is not None:
-                    self.audio_thread.join()
-                    self.clear_current_audio_file()  # Clear only the current audio file
-                    time.sleep(0.5)  # Introduce a short delay to ensure the interruption is handled
+            # Settle the reply in flight before a command adds its own message to the history
+            self.barge_in()
             if self.handle_commands(transcribed_text):
                 return  # Exit the method if a command is found and processed
-            self.process_input(transcribed_text)
+            self.process_input(transcribed_text, trace)
 
     def is_valid_transcription(self, text):
         if len(text.strip()) < 3:
@@ -542,33 +759,14 @@ class Application(tk.Tk):
         return True             
 
     def setup_keyboard_listener(self):
-        push_to_talk_key = self.config["push_to_talk_key"]
-
         def on_press(event):
-            if event.name == push_to_talk_key:
-                self.toggle_recording()
+            # Read on every press, so a new key applies as soon as the config is saved
+            if event.name == self.config["push_to_talk_key"]:
+                # The keyboard hook runs on its own thread
+                self.post_to_ui(self.toggle_recording)
 
         keyboard.on_press(on_press)
 
-    def load_config(self):
-        with open('config.yaml', 'r', encoding='utf-8') as file:
-            config = yaml.safe_load(file)
-            
-            # Convert image_max_size to a tuple of integers
-            config['image_max_size'] = tuple(map(int, config['image_max_size'].strip('()').split(',')))
-            
-            return config
-
-    def save_config(self):
-        # Get the modified configuration data from the text editor
-        config_data = self.config_text.get("1.0", "end-1c")
-
-        # Save the modified configuration data to the config.yaml file
-        with open('config.yaml', 'w', encoding='utf-8') as file:
-            file.write(config_data)
-
-        messagebox.showinfo("Info", "Configuration saved successfully.")
-
 if __name__ == "__main__":
     app = Application()
     app.mainloop()
@@ -1,24 +1,27 @@
 # IConvo/main.py
 
-from openai import OpenAI
-from chat_function import get_chat_response, load_config, setup_logging, trim_history
-from speech_to_text import transcribe_audio
-from video_processing import process_video
-from text_to_voice import text_to_speech
+from openai_client import get_client_settings
+from providers import get_chat_provider, get_transcriber, get_speech_provider, prewarm_providers
+from chat_function import trim_history, TokenBudget, HistorySummarizer, compact_message_images
+from video_processing import process_video_and_transcribe
+from text_to_voice import save_speech
+from tts_cache import get_speech_cache
+from response_cache import CachedTranscriber
+from conversation_log import setup_logging, stop_logging
+from app_config import load_config
 import logging
 from termcolor import colored
 import keyboard
 import os
 import pyaudio
-import wave
-import base64
+import numpy as np
 import time
 import tkinter as tk
 from tkinter import simpledialog
-from PIL import Image, ImageDraw, ImageOps
-import pyautogui
-import pygame
-import threading
+from PIL import Image, ImageDraw
+from screen_capture import capture_screen_base64
+from audio_player import AudioPlayer
+from audio_recorder import get_capture_profile, open_input_stream, encode_speech
 
 def create_directory(directory):
     if directory and not os.path.exists(directory):
@@ -32,59 +35,23 @@ def create_default_image(image_path):
         img.save(image_path)
         print(f"Created default image at {image_path}")
 
-def record_audio(audio_path, key, fs=44100, channels=1):
+def record_audio(key, profile, chunk_size=1024):
     print("Press and hold the push-to-talk key to record...")
     audio = pyaudio.PyAudio()
-    stream = audio.open(format=pyaudio.paInt16, channels=channels, rate=fs, input=True, frames_per_buffer=1024)
+    stream, fs = open_input_stream(audio, profile["sample_rate"], chunk_size, pyaudio.paInt16)
     frames = []
 
     while keyboard.is_pressed(key):
-        data = stream.read(1024)
+        data = stream.read(chunk_size, exception_on_overflow=False)
         frames.append(data)
 
     stream.stop_stream()
     stream.close()
     audio.terminate()
 
-    wf = wave.open(audio_path, 'wb')
-    wf.setnchannels(channels)
-    wf.setsampwidth(audio.get_sample_size(pyaudio.paInt16))
-    wf.setframerate(fs)
-    wf.writeframes(b''.join(frames))
-    wf.close()
-
+    samples = np.frombuffer(b''.join(frames), dtype=np.int16)
     print("Recording completed.")
-
-def encode_image(image_path):
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Image file not found: {image_path}")
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
-
-def capture_screen(image_path, max_size, quality):
-    try:
-        # Ensure the directory exists
-        directory = os.path.dirname(image_path)
-        create_directory(directory)
-        print(f"Directory ensured: {directory}")
-        
-        # Capture the screenshot
-        screen = pyautogui.screenshot()
-        screen = ImageOps.exif_transpose(screen)  # Correct orientation if needed
-        
-        # Debugging statements
-        print(f"Captured screenshot: {screen.size}")
-        
-        # Resize the screenshot if max_size is specified
-        if max_size:
-            screen.thumbnail(max_size, Image.LANCZOS)
-            print(f"Resized screenshot to: {screen.size}")
-        
-        # Save the screenshot
-        screen.save(image_path, "JPEG", quality=quality)
-        print(f"Screen captured and saved to {image_path}")
-    except Exception as e:
-        print(f"Error capturing or saving screenshot: {e}")
+    return encode_speech(samples, fs, profile)
 
 def get_text_input():
     class TextDialog(simpledialog.Dialog):
@@ -106,27 +73,16 @@ def get_text_input():
     root.destroy()  # Close the tkinter window
     return dialog.user_input
 
-def play_audio(file_path, interrupt_flag):
-    pygame.mixer.init()
-    try:
-        pygame.mixer.music.load(file_path)
-        pygame.mixer.music.play()
-        while pygame.mixer.music.get_busy():
-            if interrupt_flag.is_set():
-                pygame.mixer.music.stop()
-                break
-            time.sleep(0.1)
-    finally:
-        pygame.mixer.quit()
+def remove_audio_file(clip):
+    if isinstance(clip, str):
         try:
-            os.remove(file_path)
+            os.remove(clip)
         except PermissionError:
             pass
 
 def main():
     config = load_config()
 
-    api_key = config["api_key"]
     model = config["model"]
     system_prompt = config["system_prompt"]
     user_name = config["user_name"]
@@ -139,11 +95,10 @@ def main():
     push_to_talk_key = config["push_to_talk_key"]
     image_path = config["image_path"]
     audio_path = config["audio_path"]
-    image_max_size = tuple(config["image_max_size"])  # Read and convert to tuple
+    image_max_size = config["image_max_size"]
     image_quality = config["image_quality"]
-    tts_model = config["tts_model"]
-    tts_voice = config["tts_voice"]
     commands = config["commands"]
+    capture_profile = get_capture_profile(config)
 
     create_directory(os.path.dirname(log_file))
     create_directory(os.path.dirname(image_path))
@@ -152,84 +107,103 @@ def main():
     # Create a default image if the specified image file does not exist
     create_default_image(image_path)
 
-    setup_logging(log_file)
-    client = OpenAI(api_key=api_key)
+    setup_logging(config)
+    chat = get_chat_provider(config)
+    transcriber = get_transcriber(config)
+    transcript_cache = transcriber if isinstance(transcriber, CachedTranscriber) else None
+    speech = get_speech_provider(config)
+    if get_client_settings(config)["prewarm"]:
+        prewarm_providers(config)
 
     messages = [{"role": "system", "content": system_prompt}]
+    token_budget = None
+    if config["max_history_tokens"]:
+        token_budget = TokenBudget(config["max_history_tokens"], model)
+    summarizer = None
+    if config["summarize_history"]:
+        summarizer = HistorySummarizer(chat, config["summary_model"] or model, config["max_summary_tokens"])
 
     print("Chat session started. Type 'exit' to end the chat.")
 
-    audio_playing = False
-    interrupt_flag = threading.Event()
+    audio_player = AudioPlayer()
+    audio_player.start()
 
     try:
         while True:
             if keyboard.is_pressed(push_to_talk_key):
-                if audio_playing:
-                    interrupt_flag.set()
-                    audio_playing = False
-                    time.sleep(0.5)  # Small delay to ensure the playback stops
+                if audio_player.is_playing():
+                    audio_player.interrupt()
 
-                record_audio(audio_path, push_to_talk_key)
-                transcribed_text = transcribe_audio(audio_path, client)
+                recording = record_audio(push_to_talk_key, capture_profile)
+                transcribed_text = transcriber.transcribe(recording)
                 if transcribed_text:
                     print(colored(f"{user_name}: {transcribed_text}", user_color))
                     messages.append({"role": "user", "content": transcribed_text})
-                    logging.info(f"{user_name}: Transcribed audio - {transcribed_text}")
+                    logging.info(f"{user_name}: Transcribed audio - {transcribed_text}", extra={"role": "user"})
 
                     # Check for commands in the transcribed text
                     for command, keywords in commands.items():
                         if any(keyword in transcribed_text.lower() for keyword in keywords):
                             if command == "image":
                                 try:
-                                    capture_screen(image_path, image_max_size, image_quality)
-                                    base64_image = encode_image(image_path)
+                                    base64_image = capture_screen_base64(image_max_size, image_quality, config["capture_area"])
                                     messages.append({"role": "user", "content": [
-                                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
+                                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
                                     ]})
-                                    logging.info(f"{user_name}: Uploaded screen capture from {image_path}")
-                                except FileNotFoundError as e:
-                                    print(e)
+                                    logging.info(f"{user_name}: Uploaded screen capture", extra={"role": "user"})
+                                except Exception as e:
+                                    print(f"Error capturing screenshot: {e}")
                             elif command == "video":
                                 video_path = input("Enter the video file path: ")
-                                base64_frames, audio_path = process_video(video_path)
-                                transcribed_text = transcribe_audio(audio_path, client)
+                                base64_frames, audio_path, transcribed_text = process_video_and_transcribe(video_path, transcriber.transcribe, scene_threshold=config["video_scene_threshold"], transcript_cache=transcript_cache)
                                 messages.append({"role": "user", "content": [
                                     "These are the frames from the video.",
                                     *map(lambda x: {"type": "image_url", "image_url": {"url": f'data:image/jpg;base64,{x}', "detail": "low"}}, base64_frames),
                                     {"type": "text", "text": f"The audio transcription is: {transcribed_text}"}
                                 ]})
-                                logging.info(f"{user_name}: Processed video from {video_path}")
+                                logging.info(f"{user_name}: Processed video from {video_path}", extra={"role": "user"})
                             elif command == "text":
                                 user_input = get_text_input()
                                 if user_input:
                                     messages.append({"role": "user", "content": user_input})
-                                    logging.info(f"{user_name}: {user_input}")
-
-                    messages = trim_history(messages, max_history_length)
-                    response = get_chat_response(client, messages, model, max_response_tokens)
+                                    logging.info(f"{user_name}: {user_input}", extra={"role": "user"})
+
+                    on_evict = summarizer.submit if summarizer else None
+                    if token_budget:
+                        token_budget.trim(messages, on_evict, summarizer.max_summary_tokens if summarizer else 0)
+                    else:
+                        messages = trim_history(messages, max_history_length, on_evict)
+                    request_messages = summarizer.with_summary(messages) if summarizer else messages
+                    response = chat.complete(request_messages, max_response_tokens)
                     if response:
+                        if config["compact_sent_images"]:
+                            # Images are sent in full only once; afterwards the history keeps a small stand-in.
+                            # A failed request keeps them, so the model still gets to see them in full.
+                            for message in messages:
+                                if compact_message_images(message) and token_budget:
+                                    token_budget.recount(messages, message)
                         assistant_response = response.choices[0].message.content
                         print(colored(f"{assistant_name}: {assistant_response}", assistant_color))
                         messages.append({"role": "assistant", "content": assistant_response})
-                        logging.info(f"{assistant_name}: {assistant_response}")
-                        logging.info(f"Tokens - Prompt: {response.usage.prompt_tokens}, Completion: {response.usage.completion_tokens}, Total: {response.usage.total_tokens}")
+                        # Token usage is logged with the request itself
+                        logging.info(f"{assistant_name}: {assistant_response}", extra={"role": "assistant"})
 
                         # Convert assistant response to speech and play it
-                        audio_output_dir = os.path.join("data", "audio")
-                        audio_file_path = text_to_speech(api_key, tts_model, tts_voice, assistant_response, audio_output_dir)
-                        interrupt_flag.clear()
-                        audio_thread = threading.Thread(target=play_audio, args=(audio_file_path, interrupt_flag))
-                        audio_thread.start()
-
-                        audio_playing = True
+                        if config["in_memory_audio"]:
+                            audio_file_path = speech.synthesize(assistant_response)
+                        else:
+                            audio_output_dir = os.path.join("data", "audio")
+                            audio_file_path = save_speech(speech.synthesize(assistant_response), audio_output_dir)
+                        audio_player.play(audio_file_path, on_done=remove_audio_file)
 
             time.sleep(0.1)
     except KeyboardInterrupt:
         print("Shutting down...")
-        interrupt_flag.set()
-        if audio_playing:
-            audio_thread.join()  # Ensure playback thread completes
+        audio_player.close()
+        speech_cache = get_speech_cache(config)
+        if speech_cache:
+            logging.info(speech_cache.describe_stats())
+        stop_logging()
 
 if __name__ == "__main__":
     main() 
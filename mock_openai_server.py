@@ -0,0 +1,181 @@
+# IConvo/mock_openai_server.py
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A stand-in for the parts of the OpenAI API IConvo uses: chat completions
+# (plain and streamed), transcriptions, speech and the model list. Latency and
+# payload sizes are configurable, and every request body is counted, so the
+# benchmarks can measure the whole pipeline without a network or an API key.
+# It also works as a "local_server" backend for trying the GUI offline.
+DEFAULT_REPLY = (
+    "Sure, here is a short answer. It has a few sentences, so streaming has "
+    "something to split. The last one ends the reply."
+)
+
+class MockSettings:
+    def __init__(self, latency=0.2, token_delay=0.02, transcription_latency=0.3, speech_latency=0.15,
+                 reply=DEFAULT_REPLY, transcript="Hello, this is a benchmark.", speech_bytes_per_char=300):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.transcription_latency = transcription_latency
+        self.speech_latency = speech_latency
+        self.reply = reply
+        self.transcript = transcript
+        self.speech_bytes_per_char = speech_bytes_per_char
+
+def split_tokens(text):
+    # Word-sized pieces with their trailing space, roughly what the API streams
+    words = text.split(" ")
+    return [word + " " for word in words[:-1]] + words[-1:]
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def read_body(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.record(self.path, len(body))
+        return body
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.server.record(self.path, 0)
+            self.send_json({"object": "list", "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "mock"}]})
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path.endswith("/chat/completions"):
+            self.chat_completion(json.loads(body))
+        elif self.path.endswith("/audio/transcriptions"):
+            time.sleep(self.server.settings.transcription_latency)
+            self.send_json({"text": self.server.settings.transcript})
+        elif self.path.endswith("/audio/speech"):
+            self.speech(json.loads(body))
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+
+    def chat_completion(self, request):
+        settings = self.server.settings
+        model = request.get("model", "mock")
+        tokens = split_tokens(settings.reply)
+        usage = {"prompt_tokens": 50, "completion_tokens": len(tokens), "total_tokens": 50 + len(tokens)}
+        time.sleep(settings.latency)
+        if not request.get("stream"):
+            time.sleep(settings.token_delay * len(tokens))
+            self.send_json({
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": settings.reply}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(choices, **extra):
+            chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": model, "choices": choices, **extra}
+            self.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        try:
+            for token in tokens:
+                event([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+                time.sleep(settings.token_delay)
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (request.get("stream_options") or {}).get("include_usage"):
+                event([], usage=usage)
+            self.send_chunk(b"data: [DONE]\n\n")
+            self.send_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream, e.g. on barge-in
+            self.close_connection = True
+
+    def speech(self, request):
+        settings = self.server.settings
+        time.sleep(settings.speech_latency)
+        size = max(1, len(request.get("input", "")) * settings.speech_bytes_per_char)
+        # MPEG frame sync bytes followed by padding; enough for size and timing, not for playback
+        audio = (b"\xff\xfb\x90\x00" + bytes(413)) * (size // 417 + 1)
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(audio[:size])))
+        self.end_headers()
+        self.wfile.write(audio[:size])
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), MockOpenAIHandler)
+        self.settings = settings or MockSettings()
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def record(self, path, received_bytes):
+        endpoint = path.split("/v1/", 1)[-1]
+        with self.lock:
+            count, total = self.requests.get(endpoint, (0, 0))
+            self.requests[endpoint] = (count + 1, total + received_bytes)
+
+    def stats(self):
+        with self.lock:
+            return {endpoint: {"requests": count, "bytes_received": total} for endpoint, (count, total) in self.requests.items()}
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests.clear()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible server for offline runs and benchmarks")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first chat token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed tokens")
+    parser.add_argument("--transcription-latency", type=float, default=0.3)
+    parser.add_argument("--speech-latency", type=float, default=0.15)
+    args = parser.parse_args()
+    settings = MockSettings(args.latency, args.token_delay, args.transcription_latency, args.speech_latency)
+    server = MockOpenAIServer(settings, port=args.port)
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# IConvo/openai_client.py
+
+import logging
+import threading
+import httpx
+import openai
+
+# One client per backend, so chat, transcription and speech requests all share
+# the same connection pool and keep-alive connections instead of paying for a
+# new TLS handshake every turn. "openai" is the OpenAI API itself and
+# "local_server" is any OpenAI-compatible server configured under local_server.
+_clients = {}
+# AsyncOpenAI clients for the conversation engine; they are only used on its event loop
+_async_clients = {}
+_client_lock = threading.Lock()
+
+DEFAULT_CLIENT_SETTINGS = {
+    "max_connections": 10,
+    "max_keepalive_connections": 5,
+    "keepalive_expiry": 60,
+    "timeout": 30,
+    "connect_timeout": 5,
+    "max_retries": 2,
+    "prewarm": False,
+}
+DEFAULT_LOCAL_SERVER = {
+    "base_url": "http://localhost:8000/v1",
+    # Most local servers accept any key, but the SDK insists on one
+    "api_key": "local",
+}
+
+def get_client_settings(config):
+    return {**config["openai_client"], "api_key": config["api_key"], "base_url": None}
+
+def get_local_server_settings(config):
+    local_server = config["local_server"]
+    return {**config["openai_client"], "api_key": local_server["api_key"], "base_url": local_server["base_url"]}
+
+def get_pool_settings(settings):
+    limits = httpx.Limits(
+        max_connections=settings["max_connections"],
+        max_keepalive_connections=settings["max_keepalive_connections"],
+        keepalive_expiry=settings["keepalive_expiry"]
+    )
+    timeout = httpx.Timeout(settings["timeout"], connect=settings["connect_timeout"])
+    return limits, timeout
+
+def create_client(settings):
+    limits, timeout = get_pool_settings(settings)
+    http_client = openai.DefaultHttpxClient(limits=limits, timeout=timeout)
+    return openai.OpenAI(
+        api_key=settings["api_key"],
+        base_url=settings["base_url"],
+        http_client=http_client,
+        timeout=timeout,
+        max_retries=settings["max_retries"]
+    )
+
+def create_async_client(settings):
+    limits, timeout = get_pool_settings(settings)
+    http_client = openai.DefaultAsyncHttpxClient(limits=limits, timeout=timeout)
+    return openai.AsyncOpenAI(
+        api_key=settings["api_key"],
+        base_url=settings["base_url"],
+        http_client=http_client,
+        timeout=timeout,
+        max_retries=settings["max_retries"]
+    )
+
+def get_backend_settings(config, backend):
+    if backend == "local_server":
+        return get_local_server_settings(config)
+    return get_client_settings(config)
+
+def get_cached_client(clients, create, config, backend):
+    settings = get_backend_settings(config, backend)
+    with _client_lock:
+        # Rebuild only when the key, server or pool settings change
+        cached = clients.get(backend)
+        if cached is None or cached[0] != settings:
+            cached = (settings, create(settings))
+            clients[backend] = cached
+        return cached[1]
+
+def get_client(config, backend="openai"):
+    return get_cached_client(_clients, create_client, config, backend)
+
+def get_async_client(config, backend="openai"):
+    return get_cached_client(_async_clients, create_async_client, config, backend)
+
+def prewarm_client(client):
+    # Opens a pooled connection in the background so the first real turn skips DNS and TLS setup
+    def warm():
+        try:
+            client.models.list()
+            logging.info("OpenAI connection pool pre-warmed")
+        except Exception as e:
+            logging.warning(f"OpenAI pre-warm failed: {e}")
+
+    thread = threading.Thread(target=warm, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,87 @@
+# IConvo/providers.py
+
+from chat_function import OpenAIChat
+import threading
+from openai_client import get_client, get_async_client, prewarm_client
+from response_cache import CachedChat, CachedTranscriber, get_response_cache
+from speech_to_text import OpenAITranscriber, FasterWhisperTranscriber, get_faster_whisper_settings
+from text_to_voice import OpenAISpeech
+from tts_cache import CachedSpeech, get_speech_cache
+
+# The backend for each stage is picked in config.yaml under "providers":
+#
+#   chat:          complete(messages, max_response_tokens, model=None) and
+#                  stream(..., on_finish=None), plus a model attribute
+#   transcription: transcribe(audio) -> text, audio being a path or a named file
+#                  object, plus a model attribute
+#   speech:        synthesize(text) -> MP3 bytes, plus model and voice attributes
+#
+# Each method also has an a-prefixed coroutine (astream is an async generator)
+# used by the conversation engine.
+#
+# "openai" uses the OpenAI API and "local_server" any OpenAI-compatible server on
+# the LAN (see local_server in config.yaml); both share the pooled clients from
+# openai_client.py. "faster_whisper" transcribes in-process.
+DEFAULT_PROVIDERS = {
+    "chat": "openai",
+    "transcription": "openai",
+    "speech": "openai",
+}
+PROVIDERS = {kind: {} for kind in DEFAULT_PROVIDERS}
+
+def register_provider(kind, name):
+    # Decorator for a factory that takes the config and returns a provider
+    def register(factory):
+        PROVIDERS[kind][name] = factory
+        return factory
+    return register
+
+def get_provider_name(config, kind):
+    # Checked against the registry when the config is parsed
+    return config["providers"][kind]
+
+def get_provider(config, kind):
+    name = get_provider_name(config, kind)
+    if name not in PROVIDERS[kind]:
+        raise ValueError(f"Unknown {kind} provider '{name}', expected one of: {', '.join(PROVIDERS[kind])}")
+    return PROVIDERS[kind][name](config)
+
+def get_chat_provider(config):
+    chat = get_provider(config, "chat")
+    cache = get_response_cache(config)
+    if cache:
+        chat = CachedChat(chat, cache, get_provider_name(config, "chat"))
+    return chat
+
+def get_transcriber(config):
+    transcriber = get_provider(config, "transcription")
+    cache = get_response_cache(config)
+    if cache:
+        transcriber = CachedTranscriber(transcriber, cache, get_provider_name(config, "transcription"))
+    return transcriber
+
+def get_speech_provider(config):
+    speech = get_provider(config, "speech")
+    cache = get_speech_cache(config)
+    if cache:
+        speech = CachedSpeech(speech, cache, get_provider_name(config, "speech"))
+    return speech
+
+for backend in ("openai", "local_server"):
+    # Default arguments pin the backend name for each factory
+    register_provider("chat", backend)(lambda config, backend=backend: OpenAIChat(get_client(config, backend), config["model"], get_async_client(config, backend)))
+    register_provider("transcription", backend)(lambda config, backend=backend: OpenAITranscriber(get_client(config, backend), config["whisper_model"], get_async_client(config, backend)))
+    register_provider("speech", backend)(lambda config, backend=backend: OpenAISpeech(get_client(config, backend), config["tts_model"], config["tts_voice"], get_async_client(config, backend)))
+
+@register_provider("transcription", "faster_whisper")
+def create_faster_whisper(config):
+    return FasterWhisperTranscriber(**get_faster_whisper_settings(config))
+
+def prewarm_providers(config):
+    # Opens a pooled connection to every API backend in use and loads in-process models in the background
+    names = {get_provider_name(config, kind) for kind in DEFAULT_PROVIDERS}
+    for backend in ("openai", "local_server"):
+        if backend in names:
+            prewarm_client(get_client(config, backend))
+    if "faster_whisper" in names:
+        threading.Thread(target=get_transcriber, args=(config,), daemon=True).start()
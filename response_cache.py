@@ -0,0 +1,275 @@
+# IConvo/response_cache.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Opt-in cache for requests that give the same answer for the same input: chat
+# completions keyed by (backend, model, messages, max_tokens), and transcripts
+# keyed by the SHA-256 of the audio, or of the whole video for the video
+# command. Entries expire after ttl_hours and the least recently used ones are
+# evicted once the store grows past max_size_mb.
+DEFAULT_RESPONSE_CACHE = {
+    "enabled": False,
+    "path": os.path.join("data", "cache", "responses.sqlite3"),
+    "ttl_hours": 24,
+    "max_size_mb": 50,
+}
+HASH_BLOCK_SIZE = 1024 * 1024
+# Only finished replies are cached, never ones cut off by an error
+CACHEABLE_FINISH_REASONS = ("stop", "length")
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_response_cache_settings(config):
+    return config["response_cache"]
+
+def hash_request(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def hash_audio(audio):
+    # audio is a path or a file object; file objects are rewound afterwards so they can still be uploaded
+    digest = hashlib.sha256()
+    if hasattr(audio, "getbuffer"):
+        digest.update(audio.getbuffer())
+    elif hasattr(audio, "read"):
+        position = audio.tell()
+        for block in iter(lambda: audio.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+        audio.seek(position)
+    else:
+        with open(audio, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+class ResponseCache:
+    def __init__(self, path, ttl_seconds, max_bytes):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # One connection shared by all request threads, serialized by the lock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    def expired(self, created):
+        return self.ttl_seconds > 0 and time.time() - created > self.ttl_seconds
+
+    def get(self, key):
+        with self.lock, self.db:
+            row = self.db.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.expired(created):
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self.db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            return value
+
+    def put(self, key, kind, value):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", (key, kind, value, size, now, now))
+            self.evict()
+
+    def evict(self):
+        if self.ttl_seconds > 0:
+            self.db.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl_seconds,))
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def lookup(self, key):
+        # Cache problems are logged and treated as a miss; they never fail the request
+        try:
+            return self.get(key)
+        except sqlite3.Error as e:
+            logging.warning(f"Response cache lookup failed: {e}")
+            return None
+
+    def store(self, key, kind, value):
+        try:
+            self.put(key, kind, value)
+        except sqlite3.Error as e:
+            logging.warning(f"Response cache write failed: {e}")
+
+def get_response_cache(config):
+    # Returns the shared cache for the configured path, or None when caching is off
+    settings = get_response_cache_settings(config)
+    if not settings["enabled"]:
+        return None
+    path = os.path.abspath(settings["path"])
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = ResponseCache(path, 0, 0)
+            _caches[path] = cache
+        cache.ttl_seconds = settings["ttl_hours"] * 3600
+        cache.max_bytes = int(settings["max_size_mb"] * 1024 * 1024)
+        return cache
+
+class CachedChat:
+    # Wraps a chat provider. complete() caches the whole response object, and
+    # stream() caches the finished reply text, which is replayed as one piece.
+    # The async methods do their SQLite work on a worker thread, off the event loop.
+
+    def __init__(self, chat, cache, backend):
+        self.chat = chat
+        self.cache = cache
+        self.backend = backend
+        self.model = chat.model
+
+    def key(self, kind, messages, max_response_tokens, model):
+        return hash_request(kind, self.backend, model or self.model, messages, max_response_tokens)
+
+    def lookup_completion(self, key):
+        # Imported here so the cache module itself does not depend on the SDK
+        from openai.types.chat import ChatCompletion
+        cached = self.cache.lookup(key)
+        if cached is None:
+            return None
+        logging.info("Chat response served from cache")
+        return ChatCompletion.model_validate_json(cached)
+
+    def store_completion(self, key, response):
+        if response and response.choices and response.choices[0].finish_reason in CACHEABLE_FINISH_REASONS:
+            self.cache.store(key, "chat", response.model_dump_json())
+
+    def complete(self, messages, max_response_tokens, model=None):
+        key = self.key("chat", messages, max_response_tokens, model)
+        response = self.lookup_completion(key)
+        if response is None:
+            response = self.chat.complete(messages, max_response_tokens, model)
+            self.store_completion(key, response)
+        return response
+
+    async def acomplete(self, messages, max_response_tokens, model=None):
+        key = self.key("chat", messages, max_response_tokens, model)
+        response = await asyncio.to_thread(self.lookup_completion, key)
+        if response is None:
+            response = await self.chat.acomplete(messages, max_response_tokens, model)
+            await asyncio.to_thread(self.store_completion, key, response)
+        return response
+
+    def lookup_reply(self, key, on_finish):
+        cached = self.cache.lookup(key)
+        if cached is not None:
+            logging.info("Chat response served from cache")
+            if on_finish:
+                on_finish("stop")
+        return cached
+
+    def finish_recorder(self, on_finish):
+        # Returns the list the finish reasons are collected in, and the callback that fills it
+        finish_reasons = []
+
+        def finished(reason):
+            finish_reasons.append(reason)
+            if on_finish:
+                on_finish(reason)
+
+        return finish_reasons, finished
+
+    def store_reply(self, key, parts, finish_reasons):
+        if parts and finish_reasons and finish_reasons[-1] in CACHEABLE_FINISH_REASONS:
+            self.cache.store(key, "chat_stream", "".join(parts))
+
+    def stream(self, messages, max_response_tokens, model=None, on_finish=None):
+        key = self.key("chat_stream", messages, max_response_tokens, model)
+        cached = self.lookup_reply(key, on_finish)
+        if cached is not None:
+            yield cached
+            return
+        finish_reasons, finished = self.finish_recorder(on_finish)
+        parts = []
+        for token in self.chat.stream(messages, max_response_tokens, model, on_finish=finished):
+            parts.append(token)
+            yield token
+        self.store_reply(key, parts, finish_reasons)
+
+    async def astream(self, messages, max_response_tokens, model=None, on_finish=None):
+        key = self.key("chat_stream", messages, max_response_tokens, model)
+        cached = await asyncio.to_thread(self.lookup_reply, key, on_finish)
+        if cached is not None:
+            yield cached
+            return
+        finish_reasons, finished = self.finish_recorder(on_finish)
+        parts = []
+        async for token in self.chat.astream(messages, max_response_tokens, model, on_finish=finished):
+            parts.append(token)
+            yield token
+        await asyncio.to_thread(self.store_reply, key, parts, finish_reasons)
+
+class CachedTranscriber:
+    # Wraps a transcription provider, keyed by the audio content. For videos
+    # the source file itself is hashed too, so a video seen before skips audio
+    # extraction as well as transcription (see process_video_and_transcribe).
+
+    def __init__(self, transcriber, cache, backend):
+        self.transcriber = transcriber
+        self.cache = cache
+        self.backend = backend
+        self.model = transcriber.model
+
+    def key(self, kind, content_hash):
+        return hash_request(kind, self.backend, self.model, content_hash)
+
+    def audio_key(self, audio):
+        try:
+            return self.key("transcription", hash_audio(audio))
+        except OSError as e:
+            logging.warning(f"Could not hash audio for the response cache: {e}")
+            return None
+
+    def lookup_transcript(self, key):
+        cached = self.cache.lookup(key) if key else None
+        if cached is not None:
+            logging.info("Transcription served from cache")
+        return cached
+
+    def store_transcript(self, key, text):
+        if key and text is not None:
+            self.cache.store(key, "transcription", text)
+
+    def transcribe(self, audio):
+        key = self.audio_key(audio)
+        text = self.lookup_transcript(key)
+        if text is None:
+            text = self.transcriber.transcribe(audio)
+            self.store_transcript(key, text)
+        return text
+
+    async def atranscribe(self, audio):
+        # Hashing a file and the SQLite work run on a worker thread, off the event loop
+        key = await asyncio.to_thread(self.audio_key, audio)
+        text = await asyncio.to_thread(self.lookup_transcript, key)
+        if text is None:
+            text = await self.transcriber.atranscribe(audio)
+            await asyncio.to_thread(self.store_transcript, key, text)
+        return text
+
+    def source_key(self, path):
+        return self.key("source_transcription", hash_audio(path))
+
+    def lookup(self, key):
+        return self.cache.lookup(key)
+
+    def store(self, key, text):
+        self.cache.store(key, "source_transcription", text)
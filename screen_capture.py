@@ -0,0 +1,55 @@
+# IConvo/screen_capture.py
+
+import base64
+import io
+from PIL import Image
+
+def parse_capture_area(area):
+    # "screen" (or empty) grabs everything, "active_window" grabs the focused
+    # window, and "left,top,width,height" grabs a fixed region
+    if not area or area == "screen":
+        return None
+    if area == "active_window":
+        return area
+    if isinstance(area, str):
+        area = area.strip("()").split(",")
+    return tuple(int(value) for value in area)
+
+def get_active_window_region():
+    import pyautogui
+    try:
+        window = pyautogui.getActiveWindow()
+    except (AttributeError, NotImplementedError):
+        # Window lookup is only available on some platforms
+        return None
+    if window is None or window.width <= 0 or window.height <= 0:
+        return None
+    left, top = max(window.left, 0), max(window.top, 0)
+    return (left, top, window.width - (left - window.left), window.height - (top - window.top))
+
+def grab_screen(area=None):
+    # pyautogui is imported here so the encoding helpers below also work headless
+    import pyautogui
+    region = parse_capture_area(area)
+    if region == "active_window":
+        region = get_active_window_region()
+    return pyautogui.screenshot(region=region)
+
+def resize_screenshot(image, max_size):
+    # Screenshots carry no EXIF orientation, so there is nothing to transpose.
+    # reducing_gap lets Pillow shrink large captures with a cheap integer box
+    # reduction first, then finish with bilinear filtering.
+    if max_size:
+        image.thumbnail(tuple(max_size), Image.BILINEAR, reducing_gap=2.0)
+    return image
+
+def encode_screenshot(image, max_size, quality):
+    image = resize_screenshot(image, max_size)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+def capture_screen_base64(max_size, quality, area=None):
+    return encode_screenshot(grab_screen(area), max_size, quality)
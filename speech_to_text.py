@@ -1,19 +1,162 @@
 # IConvo/speech_to_text.py
 
+import asyncio
 import openai
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-def transcribe_audio(audio_path, client):
+# faster-whisper is optional; it is only needed for the in-process transcription backend
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+
+DEFAULT_FASTER_WHISPER = {
+    "model": "base",
+    "device": "auto",
+    "compute_type": "default",
+    "beam_size": 1,
+}
+# Loading a model takes seconds, so one instance is kept per settings
+_whisper_models = {}
+_whisper_lock = threading.Lock()
+
+def transcribe_audio(audio, client, model="whisper-1"):
+    # audio is either a file path or an in-memory file object with a name such as "speech.flac"
     try:
-        with open(audio_path, "rb") as audio_file:
+        if hasattr(audio, "read"):
             transcription = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file
+                model=model,
+                file=audio
             )
+        else:
+            with open(audio, "rb") as audio_file:
+                transcription = client.audio.transcriptions.create(
+                    model=model,
+                    file=audio_file
+                )
         return transcription.text
     except openai.OpenAIError as e:
         logging.error(f"OpenAI API error during transcription: {str(e)}")
         return None
     except Exception as e:
         logging.error(f"Unexpected error during transcription: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+async def atranscribe_audio(audio, client, model="whisper-1"):
+    # Async counterpart of transcribe_audio, for the conversation engine
+    try:
+        if hasattr(audio, "read"):
+            transcription = await client.audio.transcriptions.create(model=model, file=audio)
+        else:
+            with open(audio, "rb") as audio_file:
+                transcription = await client.audio.transcriptions.create(model=model, file=audio_file)
+        return transcription.text
+    except openai.OpenAIError as e:
+        logging.error(f"OpenAI API error during transcription: {str(e)}")
+        return None
+    except Exception as e:
+        logging.error(f"Unexpected error during transcription: {str(e)}")
+        return None
+
+class OpenAITranscriber:
+    # Whisper through the OpenAI API, or through a local server that speaks the same API
+
+    def __init__(self, client, model="whisper-1", async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+
+    def transcribe(self, audio):
+        return transcribe_audio(audio, self.client, self.model)
+
+    async def atranscribe(self, audio):
+        return await atranscribe_audio(audio, self.async_client, self.model)
+
+def get_faster_whisper_settings(config):
+    return config["faster_whisper"]
+
+def load_whisper_model(model, device, compute_type):
+    if WhisperModel is None:
+        raise RuntimeError("faster-whisper is not installed; run pip install faster-whisper")
+    key = (model, device, compute_type)
+    with _whisper_lock:
+        if key not in _whisper_models:
+            logging.info(f"Loading faster-whisper model {model} on {device}")
+            _whisper_models[key] = WhisperModel(model, device=device, compute_type=compute_type)
+        return _whisper_models[key]
+
+class FasterWhisperTranscriber:
+    # Runs Whisper in-process with faster-whisper, so nothing leaves the machine
+
+    def __init__(self, model="base", device="auto", compute_type="default", beam_size=1):
+        self.model = model
+        self.whisper = load_whisper_model(model, device, compute_type)
+        self.beam_size = beam_size
+
+    def transcribe(self, audio):
+        # faster-whisper decodes paths and file objects itself
+        try:
+            segments, _ = self.whisper.transcribe(audio, beam_size=self.beam_size)
+            return " ".join(segment.text.strip() for segment in segments)
+        except Exception as e:
+            logging.error(f"Unexpected error during transcription: {str(e)}")
+            return None
+
+    async def atranscribe(self, audio):
+        # The model runs on a worker thread so the event loop stays responsive
+        return await asyncio.to_thread(self.transcribe, audio)
+
+class ChunkedTranscriber:
+    # Transcribes the segments of an utterance on a worker pool while recording
+    # is still going on. Results are stitched back together in segment order;
+    # on_partial receives the text of the leading segments that are done so far.
+
+    def __init__(self, transcribe, max_workers=3, on_partial=None):
+        self.transcribe = transcribe
+        self.on_partial = on_partial
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.segments = []
+
+    def submit(self, audio):
+        future = self.executor.submit(self.transcribe, audio)
+        with self.lock:
+            segments = self.segments
+            segments.append(future)
+        if self.on_partial:
+            future.add_done_callback(lambda _: self.report_partial(segments))
+
+    def report_partial(self, segments):
+        with self.lock:
+            if segments is not self.segments:
+                return  # The utterance was already completed or discarded
+        text = stitch_transcripts(segments, wait=False)
+        if text:
+            self.on_partial(text)
+
+    def take_segments(self):
+        # Hands over the segments of the finished utterance and starts a new one
+        with self.lock:
+            segments = self.segments
+            self.segments = []
+        return segments
+
+    def discard(self):
+        for future in self.take_segments():
+            future.cancel()
+
+    def shutdown(self):
+        self.discard()
+        self.executor.shutdown(wait=False)
+
+def stitch_transcripts(segments, wait=True):
+    texts = []
+    for future in segments:
+        if not wait and not future.done():
+            break
+        text = future.result()
+        if text:
+            texts.append(text.strip())
+    return " ".join(texts)
\ No newline at end of file
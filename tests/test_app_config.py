@@ -0,0 +1,80 @@
+# IConvo/tests/test_app_config.py
+
+import pytest
+from app_config import ConfigError, parse_config, parse_config_text
+from tracing import DEFAULT_TRACING
+
+def parse(**settings):
+    return parse_config({"api_key": "test", "model": "gpt-4o", **settings})
+
+def problems(**settings):
+    with pytest.raises(ConfigError) as error:
+        parse(**settings)
+    return str(error.value).splitlines()[1:]
+
+def test_defaults_are_filled_in():
+    config = parse()
+    assert config["max_history_length"] == 20
+    assert config["stream_responses"] is False
+    assert config["whisper_model"] == "whisper-1"
+    assert config["image_max_size"] == (1600, 1600)
+
+def test_values_are_converted():
+    config = parse(max_history_length="12", video_scene_threshold="0.4", image_max_size="800, 600", barge_in="yes")
+    assert config["max_history_length"] == 12
+    assert config["video_scene_threshold"] == 0.4
+    assert config["image_max_size"] == (800, 600)
+    assert config["barge_in"] is True
+
+@pytest.mark.parametrize("value", ["maybe", "2", "", [True]])
+def test_booleans_are_strict(value):
+    assert problems(stream_responses=value) == [f"stream_responses: expected true or false, got {value!r}"]
+
+def test_numbers_do_not_accept_booleans():
+    assert problems(max_response_tokens=True) == ["max_response_tokens: expected a whole number, got True"]
+
+@pytest.mark.parametrize("key, value", [
+    ("max_history_length", 1),
+    ("image_quality", 101),
+    ("video_scene_threshold", -0.1),
+    ("max_response_tokens", 0),
+])
+def test_out_of_range_values_are_rejected(key, value):
+    (problem,) = problems(**{key: value})
+    assert problem.startswith(f"{key}: must be")
+
+def test_missing_required_keys_are_reported():
+    with pytest.raises(ConfigError) as error:
+        parse_config({})
+    assert str(error.value).splitlines()[1:] == ["api_key: missing", "model: missing"]
+
+def test_section_defaults_fill_in_left_out_settings():
+    tracing = parse(tracing={"enabled": "off"})["tracing"]
+    assert tracing == {**DEFAULT_TRACING, "enabled": False}
+    # Every default is converted too, not just the values from the file
+    assert isinstance(parse()["response_cache"]["ttl_hours"], float)
+
+def test_section_settings_are_checked():
+    assert problems(tracing={"backup_count": -1}, conversation_log={"when": "weekly"}) == [
+        "tracing.backup_count: must be at least 0, got -1",
+        "conversation_log.when: expected s, m, h, d, midnight or w0-w6, got 'weekly'",
+    ]
+
+def test_section_must_be_a_mapping():
+    assert problems(tracing="on") == ["tracing: expected a mapping, got 'on'"]
+
+def test_every_problem_is_reported_at_once():
+    found = problems(barge_in="sometimes", image_quality=0, openai_client={"max_connections": 0}, providers={"chat": "nowhere"})
+    assert [problem.split(":")[0] for problem in found] == ["image_quality", "barge_in", "openai_client.max_connections", "providers.chat"]
+
+def test_snapshot_is_read_only():
+    config = parse()
+    with pytest.raises(TypeError):
+        config["model"] = "other"
+    with pytest.raises(TypeError):
+        config["tracing"]["enabled"] = False
+
+def test_yaml_text():
+    assert parse_config_text("api_key: test\nmodel: gpt-4o\nsummarize_history: on\n")["summarize_history"] is True
+    with pytest.raises(ConfigError):
+        parse_config_text("api_key: [unclosed")
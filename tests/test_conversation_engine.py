@@ -0,0 +1,96 @@
+# IConvo/tests/test_conversation_engine.py
+
+import asyncio
+import threading
+import time
+import pytest
+import conversation_engine
+from app_config import parse_config
+from conversation_engine import ConversationEngine
+
+class FakeChat:
+    model = "fake"
+
+    def __init__(self, finish=True, delay=0):
+        self.finish = finish
+        self.delay = delay
+
+    async def astream(self, messages, max_response_tokens, model=None, on_finish=None):
+        await asyncio.sleep(self.delay)
+        for token in ["Hello there. ", "How are you?"]:
+            yield token
+        if self.finish and on_finish:
+            on_finish("stop")
+
+class FakeSpeech:
+    async def asynthesize(self, text):
+        return text.encode()
+
+class FakePlayer:
+    # Plays every clip at once, noting which turn it came from
+    def __init__(self):
+        self.clips = []
+
+    def play(self, clip, on_done=None, on_start=None):
+        self.clips.append(clip)
+        if on_start:
+            on_start(clip)
+        if on_done:
+            on_done(clip)
+        return True
+
+    def interrupt(self):
+        return 0
+
+@pytest.fixture
+def engine(monkeypatch):
+    def make(chat=None):
+        monkeypatch.setattr(conversation_engine, "get_chat_provider", lambda config: chat or FakeChat())
+        monkeypatch.setattr(conversation_engine, "get_speech_provider", lambda config: FakeSpeech())
+        engine = ConversationEngine(FakePlayer(), lambda callback, *args: callback(*args))
+        engine.start()
+        engines.append(engine)
+        return engine
+    engines = []
+    yield make
+    for engine in engines:
+        engine.close()
+
+CONFIG = parse_config({"api_key": "test", "model": "fake", "stream_responses": True, "in_memory_audio": True})
+MESSAGES = [{"role": "user", "content": "Hi"}]
+
+def run_turn(engine, **callbacks):
+    replies = {}
+    done = threading.Event()
+
+    def on_reply(generation, reply):
+        replies[generation] = reply
+        done.set()
+
+    generation = engine.start_turn(CONFIG, MESSAGES, lambda generation, text: None, on_reply, **callbacks)
+    return generation, replies, done
+
+def test_complete_reply_is_spoken(engine):
+    engine = engine()
+    generation, replies, done = run_turn(engine)
+    assert done.wait(5)
+    assert replies[generation] == "Hello there. How are you?"
+    assert engine.audio_player.clips == [b"Hello there.", b"How are you?"]
+
+def test_reply_without_finish_reason_fails(engine):
+    engine = engine(FakeChat(finish=False))
+    generation, replies, done = run_turn(engine)
+    assert done.wait(5)
+    assert replies[generation] is None
+
+def test_turn_cancelled_before_it_starts_never_plays(engine):
+    engine = engine(FakeChat(delay=0.5))
+    run_turn(engine)
+    time.sleep(0.1)
+    # The second turn is cancelled while it is still waiting for the first to wind down
+    generation, replies, _ = run_turn(engine)
+    engine.cancel_turn(generation).result(timeout=5)
+    # Long enough for the second turn to have spoken had it started
+    time.sleep(1.0)
+    assert engine.audio_player.clips == []
+    assert generation not in replies
@@ -0,0 +1,90 @@
+# IConvo/tests/test_endpointer.py
+
+import numpy as np
+from audio_recorder import Endpointer
+
+SAMPLE_RATE = 16000
+CHUNK_SIZE = 1024
+CHUNK_SECONDS = CHUNK_SIZE / SAMPLE_RATE
+
+def speech(seconds):
+    # A voiced-sounding signal: harmonics of a wandering pitch under a syllable-rate envelope
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    voice = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    return np.clip(voice * envelope * 0.25 * 32767, -32768, 32767).astype(np.int16)
+
+def silence(seconds):
+    # Quiet room noise
+    return np.random.default_rng(0).normal(0, 60, int(seconds * SAMPLE_RATE)).astype(np.int16)
+
+def click(seconds=0.05):
+    return np.random.default_rng(1).normal(0, 8000, int(seconds * SAMPLE_RATE)).astype(np.int16)
+
+def run(samples, **settings):
+    # Feeds samples in capture-sized chunks; returns (sample offset when handed over, utterance) pairs
+    endpointer = Endpointer(SAMPLE_RATE, **settings)
+    utterances = []
+    for offset in range(0, len(samples), CHUNK_SIZE):
+        for utterance in endpointer.process(samples[offset:offset + CHUNK_SIZE]):
+            utterances.append((offset + CHUNK_SIZE, utterance))
+    return utterances
+
+def test_short_command_is_kept():
+    utterances = run(np.concatenate([silence(1.0), speech(0.6), silence(1.5)]))
+    assert len(utterances) == 1
+    seconds = len(utterances[0][1]) / SAMPLE_RATE
+    # The command itself plus at most the pre-roll and the trailing silence that is kept
+    assert 0.5 <= seconds <= 0.6 + 0.3 + 0.1 + 2 * CHUNK_SECONDS
+
+def test_pause_inside_sentence_does_not_split_it():
+    utterances = run(np.concatenate([silence(1.0), speech(1.5), silence(0.2), speech(1.5), silence(1.5)]))
+    assert len(utterances) == 1
+    assert len(utterances[0][1]) / SAMPLE_RATE >= 3.0
+
+def test_max_utterance_duration_flushes():
+    samples = np.concatenate([silence(1.0), speech(12.0), silence(1.5)])
+    utterances = run(samples, max_utterance_duration=5)
+    assert len(utterances) >= 2
+    emitted_at, first = utterances[0]
+    # Handed over while the user was still talking, at the cap
+    assert emitted_at < (1.0 + 12.0) * SAMPLE_RATE
+    assert 5 <= len(first) / SAMPLE_RATE <= 5 + CHUNK_SECONDS
+
+def test_click_is_dropped():
+    assert run(np.concatenate([silence(1.0), click(), silence(1.5)])) == []
+
+def test_hangover_latency_is_bounded():
+    hangover = 0.5
+    voice = speech(1.0)
+    # The syllable envelope goes quiet before the signal ends; time from the last audible sample
+    speech_end = int(1.0 * SAMPLE_RATE) + np.flatnonzero(np.abs(voice) > 300)[-1]
+    utterances = run(np.concatenate([silence(1.0), voice, silence(2.0)]), silence_hangover=hangover)
+    assert len(utterances) == 1
+    latency = (utterances[0][0] - speech_end) / SAMPLE_RATE
+    # Endpointing takes the hangover, give or take the chunk the speech ended in and the one that crossed it
+    assert hangover - CHUNK_SECONDS <= latency <= hangover + 2 * CHUNK_SECONDS
+
+def hum(seconds, rms=500):
+    # Mains hum: loud enough to pass as speech, but it never lets up
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (rms * np.sqrt(2) * np.sin(2 * np.pi * 120 * t)).astype(np.int16)
+
+def test_steady_hum_is_not_speech_forever():
+    utterances = run(np.concatenate([silence(1.0), hum(30.0)]), max_utterance_duration=15)
+    # The hum may open an utterance before the floor catches up, but not keep one open
+    assert all(len(utterance) / SAMPLE_RATE < 15 for _, utterance in utterances)
+
+def test_command_over_hum_is_kept():
+    background = hum(14.0)
+    voice = speech(0.8)
+    start = 10 * SAMPLE_RATE
+    mixed = background.astype(np.int32)
+    mixed[start:start + len(voice)] += voice
+    samples = np.concatenate([silence(1.0), np.clip(mixed, -32768, 32767).astype(np.int16)])
+    utterances = run(samples, max_utterance_duration=15)
+    spoken = [utterance for emitted_at, utterance in utterances if emitted_at > (1.0 + 10.0) * SAMPLE_RATE]
+    assert len(spoken) == 1
+    assert len(spoken[0]) / SAMPLE_RATE >= 0.6
@@ -0,0 +1,81 @@
+# IConvo/tests/test_token_budget.py
+
+from chat_function import TokenBudget, TOKENS_PER_REPLY, LOW_DETAIL_IMAGE_TOKENS, get_message_tokens
+
+def message(role, words):
+    return {"role": role, "content": " ".join(f"word{index}" for index in range(words))}
+
+def history(turns, words=20):
+    messages = [message("system", 10)]
+    for turn in range(turns):
+        messages.append(message("user" if turn % 2 == 0 else "assistant", words))
+    return messages
+
+def fresh_count(budget, messages):
+    return TOKENS_PER_REPLY + sum(get_message_tokens(item, budget.encoding) for item in messages)
+
+def assert_aligned(budget, messages):
+    # The cached counts must line up with the history, message for message
+    assert budget.message_tokens == [get_message_tokens(item, budget.encoding) for item in messages]
+    assert budget.total_tokens == fresh_count(budget, messages)
+
+def test_trim_fits_budget_and_keeps_system_prompt_and_latest():
+    messages = history(20)
+    system, latest = messages[0], messages[-1]
+    budget = TokenBudget(200)
+    budget.trim(messages)
+    assert messages[0] is system and messages[-1] is latest
+    assert len(messages) < 21
+    assert budget.total_tokens <= 200
+    assert_aligned(budget, messages)
+
+def test_counts_stay_aligned_across_turns():
+    messages = history(2)
+    budget = TokenBudget(250)
+    for turn in range(15):
+        messages.append(message("user" if turn % 2 == 0 else "assistant", 20 + turn))
+        budget.trim(messages)
+        assert budget.total_tokens <= 250
+        assert_aligned(budget, messages)
+
+def test_evicted_messages_are_handed_over_oldest_first():
+    messages = history(10)
+    expected = list(messages)
+    evicted = []
+    TokenBudget(150).trim(messages, on_evict=evicted.extend)
+    assert evicted
+    assert evicted == expected[1:1 + len(evicted)]
+    assert messages == expected[:1] + expected[1 + len(evicted):]
+
+def test_system_prompt_and_latest_message_are_kept_over_budget():
+    messages = [message("system", 300), message("user", 300), message("user", 300)]
+    budget = TokenBudget(10)
+    budget.trim(messages)
+    assert len(messages) == 2
+    assert_aligned(budget, messages)
+
+def test_reserved_tokens_evict_more():
+    plain, reserved = history(10), history(10)
+    TokenBudget(300).trim(plain)
+    TokenBudget(300).trim(reserved, reserved_tokens=100)
+    assert len(reserved) < len(plain)
+
+def test_recount_after_in_place_changes():
+    messages = history(6)
+    budget = TokenBudget(10000)
+    budget.trim(messages)
+    # A longer system prompt is swapped in, and an image is compacted to a low detail stand-in
+    messages[0] = message("system", 500)
+    budget.recount(messages, messages[0])
+    messages[3]["content"] = [{"type": "image_url", "image_url": {"url": "https://example.com/a.jpg", "detail": "low"}}]
+    budget.recount(messages, messages[3])
+    assert_aligned(budget, messages)
+    assert budget.message_tokens[3] >= LOW_DETAIL_IMAGE_TOKENS
+
+def test_recount_ignores_messages_not_in_history():
+    messages = history(4)
+    budget = TokenBudget(10000)
+    budget.trim(messages)
+    total = budget.total_tokens
+    budget.recount(messages, message("user", 50))
+    assert budget.total_tokens == total
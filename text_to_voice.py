@@ -1,12 +1,44 @@
 # IConvo/text_to_voice.py
-from openai import OpenAI
 import os
-import re
 import time
 
-def text_to_speech(api_key, model, voice, text, output_dir):
-    client = OpenAI(api_key=api_key)
+def text_to_speech_bytes(client, model, voice, text):
+    response = client.audio.speech.create(
+        model=model,
+        voice=voice,
+        input=text
+    )
     
+    # Keep the encoded MP3 in memory so it can be played without touching the disk
+    return b"".join(response.iter_bytes())
+
+async def atext_to_speech_bytes(client, model, voice, text):
+    response = await client.audio.speech.create(
+        model=model,
+        voice=voice,
+        input=text
+    )
+    return await response.aread()
+
+class OpenAISpeech:
+    # Text-to-speech through the OpenAI API, or through a local server that speaks the same API
+
+    def __init__(self, client, model, voice, async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+        self.voice = voice
+
+    def synthesize(self, text):
+        return text_to_speech_bytes(self.client, self.model, self.voice, text)
+
+    async def asynthesize(self, text):
+        return await atext_to_speech_bytes(self.async_client, self.model, self.voice, text)
+
+def text_to_speech(client, model, voice, text, output_dir):
+    return save_speech(text_to_speech_bytes(client, model, voice, text), output_dir)
+
+def save_speech(audio_bytes, output_dir):
     # Ensure the directory exists
     os.makedirs(output_dir, exist_ok=True)
     
@@ -15,32 +47,23 @@ def text_to_speech(api_key, model, voice, text, output_dir):
     file_name = f"response_{timestamp}.mp3"
     output_path = os.path.join(output_dir, file_name)
     
-    response = client.audio.speech.create(
-        model=model,
-        voice=voice,
-        input=text
-    )
-    
     with open(output_path, "wb") as f:
-        for chunk in response.iter_bytes():
-            f.write(chunk)
+        f.write(audio_bytes)
     
     print(f"Audio saved to {output_path}")
     return output_path
 
 if __name__ == "__main__":
-    import yaml
+    from app_config import load_config
     
     # Load config
-    with open("config.yaml", "r") as file:
-        config = yaml.safe_load(file)
+    config = load_config()
     
-    api_key = config["api_key"]
-    tts_model = config["tts_model"]
-    tts_voice = config["tts_voice"]
+    from providers import get_speech_provider
+    speech = get_speech_provider(config)
     
     sample_text = "This is a sample text to speech conversion."
     output_dir = os.path.join("data", "audio")
     
     # Convert text to speech
-    text_to_speech(api_key, tts_model, tts_voice, sample_text, output_dir)
\ No newline at end of file
+    save_speech(speech.synthesize(sample_text), output_dir)
\ No newline at end of file
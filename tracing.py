@@ -0,0 +1,213 @@
+# IConvo/tracing.py
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import QueueListener, RotatingFileHandler
+
+# Per-turn latency tracing. Every stage of a turn (end of speech, STT, LLM,
+# TTS, playback) is recorded as a span tagged with the turn's ID and appended
+# to a rolling JSONL file, one object per line, so a slow turn can be taken
+# apart afterwards. The Console shows a one-line breakdown of each turn.
+DEFAULT_TRACING = {
+    "enabled": True,
+    "path": os.path.join("logs", "traces.jsonl"),
+    "max_size_mb": 5,
+    "backup_count": 3,
+    "console_breakdown": True,
+}
+# The stages shown in the Console, in turn order
+BREAKDOWN_LABELS = [
+    ("endpoint", "endpoint"),
+    ("stt", "STT"),
+    ("llm_first_token", "LLM first token"),
+    ("llm", "LLM done"),
+    ("tts_first", "first TTS"),
+    ("first_audio", "first audio at"),
+    ("playback_end", "playback end at"),
+]
+# The ID of the turn the current engine task belongs to, for tagging log records
+current_turn_id = contextvars.ContextVar("current_turn_id", default=None)
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_tracing_settings(config):
+    return config["tracing"]
+
+class TraceWriter:
+    # Records are queued and written by a QueueListener thread, so tracing never
+    # waits on the disk from the audio, UI or event loop threads. The file rolls
+    # over to path.1, path.2, ... once it reaches max_bytes.
+
+    def __init__(self, path, max_bytes, backup_count):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.queue = queue.SimpleQueue()
+        self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.listener = QueueListener(self.queue, self.handler)
+        self.listener.start()
+
+    def write(self, record):
+        self.queue.put(logging.makeLogRecord({"msg": json.dumps(record, ensure_ascii=False), "levelno": logging.INFO, "levelname": "INFO"}))
+
+    def close(self):
+        # Writes whatever is still queued before returning
+        self.listener.stop()
+        self.handler.close()
+
+def get_trace_writer(config):
+    # Returns the shared writer for the configured file, or None when tracing is off
+    settings = get_tracing_settings(config)
+    if not settings["enabled"]:
+        return None
+    path = os.path.abspath(settings["path"])
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = TraceWriter(path, int(settings["max_size_mb"] * 1024 * 1024), settings["backup_count"])
+            _writers[path] = writer
+        return writer
+
+def close_trace_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+def trace_event(config, name, **attributes):
+    # Events outside any turn, such as recording being switched on or off
+    writer = get_trace_writer(config)
+    if writer:
+        writer.write({"time": time.time(), "event": name, **attributes})
+
+class TurnTrace:
+    # The timeline of one turn. Offsets are relative to the moment the turn
+    # began: the end of the user's speech, or Enter for typed input, so spans
+    # before it (the speech itself, the endpoint hangover) have negative
+    # offsets. Spans are written as they end; finish() writes a summary record
+    # and calls on_finish(trace). Spans come from the recording, engine and
+    # player threads. Without a writer nothing is written, but the breakdown
+    # is still collected.
+
+    def __init__(self, writer=None, on_finish=None):
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.writer = writer
+        self.on_finish = on_finish
+        self.generation = None
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        # name -> {"offset", "duration"} of the first span, plus "count" and "total" over all of them
+        self.spans = {}
+        self.clips_queued = 0
+        self.clips_played = 0
+        self.clips_complete = False
+        self.status = None
+
+    def write(self, record):
+        if self.writer:
+            self.writer.write({"turn_id": self.turn_id, **record})
+
+    def add_span(self, name, start, end, **attributes):
+        # start and end are time.perf_counter() values
+        offset = start - self.origin
+        duration = end - start
+        with self.lock:
+            span = self.spans.setdefault(name, {"offset": offset, "duration": duration, "count": 0, "total": 0.0})
+            span["count"] += 1
+            span["total"] += duration
+        self.write({
+            "span": name,
+            "time": self.started + offset,
+            "offset_ms": round(offset * 1000, 1),
+            "duration_ms": round(duration * 1000, 1),
+            **attributes,
+        })
+
+    @contextmanager
+    def span(self, name, **attributes):
+        # The attributes dict is yielded, so the body can add to it
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            self.add_span(name, start, time.perf_counter(), **attributes)
+
+    def mark(self, name, **attributes):
+        now = time.perf_counter()
+        self.add_span(name, now, now, **attributes)
+
+    # Playback. The player reports clips from its own thread; the turn is
+    # finished once the last clip has played.
+
+    def clip_queued(self):
+        with self.lock:
+            self.clips_queued += 1
+
+    def clip_started(self, clip):
+        if "first_audio" not in self.spans:
+            self.mark("first_audio")
+
+    def clip_done(self):
+        with self.lock:
+            self.clips_played += 1
+            played = self.clips_complete and self.clips_played >= self.clips_queued
+        if played:
+            self.end_playback()
+
+    def all_clips_queued(self):
+        with self.lock:
+            self.clips_complete = True
+            played = self.clips_played >= self.clips_queued
+        if played:
+            self.end_playback()
+
+    def end_playback(self):
+        self.mark("playback_end")
+        self.finish("ok")
+
+    def finish(self, status):
+        # Only the first call counts, e.g. a cancelled turn is not finished again by its flushed clips
+        with self.lock:
+            if self.status is not None:
+                return
+            self.status = status
+        self.write({"event": "turn", "time": self.started, "generation": self.generation, "status": status,
+                    "breakdown_ms": {name: round(value * 1000, 1) for name, value in self.breakdown().items()}})
+        if self.on_finish:
+            self.on_finish(self)
+
+    def breakdown(self):
+        # Seconds spent in, or until, each stage; stages the turn did not reach are left out
+        with self.lock:
+            spans = {name: dict(span) for name, span in self.spans.items()}
+        breakdown = {}
+        for name in ("vad_endpoint", "stt", "llm"):
+            if name in spans:
+                breakdown["endpoint" if name == "vad_endpoint" else name] = spans[name]["duration"]
+        if "llm" in spans and "first_token" in spans:
+            breakdown["llm_first_token"] = spans["first_token"]["offset"] - spans["llm"]["offset"]
+        if "tts" in spans:
+            breakdown["tts_first"] = spans["tts"]["duration"]
+            breakdown["tts_total"] = spans["tts"]["total"]
+        for name in ("first_audio", "playback_end"):
+            if name in spans:
+                breakdown[name] = spans[name]["offset"]
+        return breakdown
+
+    def describe(self):
+        # One line for the Console
+        breakdown = self.breakdown()
+        parts = [f"{label} {breakdown[name] * 1000:.0f} ms" for name, label in BREAKDOWN_LABELS if name in breakdown]
+        status = "" if self.status in (None, "ok") else f" ({self.status})"
+        return f"Latency{status}: {' | '.join(parts) or 'no stages recorded'}"
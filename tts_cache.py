@@ -0,0 +1,174 @@
+# IConvo/tts_cache.py
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# Synthesized speech is stored on disk under the SHA-256 of (backend, model,
+# voice, normalized text), so greetings, acknowledgements and other repeated
+# sentences play back without another API call. An SQLite index keeps sizes
+# and last use times for LRU eviction, plus hit/miss counters across sessions.
+DEFAULT_TTS_CACHE = {
+    "enabled": False,
+    "directory": os.path.join("data", "tts_cache"),
+    "max_size_mb": 200,
+}
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_tts_cache_settings(config):
+    return config["tts_cache"]
+
+def normalize_text(text):
+    # Only differences that cannot change the spoken result are folded away
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def speech_cache_key(backend, model, voice, text):
+    return hashlib.sha256("\0".join((backend, model, voice, normalize_text(text))).encode("utf-8")).hexdigest()
+
+class SpeechCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # One connection shared by the TTS threads, serialized by the lock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self.db.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)")
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def count(self, name):
+        self.db.execute("UPDATE stats SET value = value + 1 WHERE name = ?", (name,))
+
+    def get(self, key):
+        with self.lock, self.db:
+            row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row:
+                try:
+                    with open(self.path(key), "rb") as f:
+                        audio_bytes = f.read()
+                except OSError:
+                    # The file was removed behind our back; forget the entry
+                    self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                else:
+                    self.db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self.count("hits")
+                    return audio_bytes
+            self.count("misses")
+            return None
+
+    def put(self, key, audio_bytes):
+        if not audio_bytes or len(audio_bytes) > self.max_bytes:
+            return
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name first so a crash never leaves a truncated clip behind
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(audio_bytes)
+        os.replace(temp_path, path)
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, len(audio_bytes), time.time()))
+            self.evict()
+
+    def evict(self):
+        # Drops the least recently used clips until the cache fits in max_bytes again
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.db.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def describe_stats(self):
+        stats = self.stats()
+        return (f"TTS cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+                f"{stats['entries']} clips, {stats['bytes'] / (1024 * 1024):.1f} MB")
+
+def get_speech_cache(config):
+    # Returns the shared cache for the configured directory, or None when caching is off
+    settings = get_tts_cache_settings(config)
+    if not settings["enabled"]:
+        return None
+    directory = os.path.abspath(settings["directory"])
+    max_bytes = int(settings["max_size_mb"] * 1024 * 1024)
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = SpeechCache(directory, max_bytes)
+            _caches[directory] = cache
+        cache.max_bytes = max_bytes
+        return cache
+
+class CachedSpeech:
+    # Wraps a speech provider; only cache misses reach the backend
+
+    def __init__(self, speech, cache, backend):
+        self.speech = speech
+        self.cache = cache
+        self.backend = backend
+        self.model = speech.model
+        self.voice = speech.voice
+
+    def key(self, text):
+        return speech_cache_key(self.backend, self.model, self.voice, text)
+
+    def lookup(self, key):
+        try:
+            return self.cache.get(key)
+        except sqlite3.Error as e:
+            logging.warning(f"TTS cache lookup failed: {e}")
+            return None
+
+    def store(self, key, audio_bytes):
+        try:
+            self.cache.put(key, audio_bytes)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"TTS cache write failed: {e}")
+
+    def synthesize(self, text):
+        key = self.key(text)
+        audio_bytes = self.lookup(key)
+        if audio_bytes is None:
+            audio_bytes = self.speech.synthesize(text)
+            self.store(key, audio_bytes)
+        return audio_bytes
+
+    async def asynthesize(self, text):
+        # The index query, file I/O and eviction run on a worker thread, off the event loop
+        key = self.key(text)
+        audio_bytes = await asyncio.to_thread(self.lookup, key)
+        if audio_bytes is None:
+            audio_bytes = await self.speech.asynthesize(text)
+            await asyncio.to_thread(self.store, key, audio_bytes)
+        return audio_bytes
@@ -4,32 +4,115 @@ import cv2
 from moviepy.editor import VideoFileClip
 import os
 import base64
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def process_video(video_path, seconds_per_frame=2):
-    base64_frames = []
-    base_video_path, _ = os.path.splitext(video_path)
+# "low" detail images are processed at 512x512, so larger frames only cost upload time
+LOW_DETAIL_FRAME_SIZE = 512
+FRAME_JPEG_QUALITY = 80
+# In scene-change mode a candidate frame is checked this often
+SCENE_CHECK_SECONDS = 0.5
+SCENE_SIGNATURE_SIZE = (64, 36)
+# Frame encoding, audio extraction and transcription share one small pool
+VIDEO_WORKERS = 4
+
+def downscale_frame(frame, max_size=LOW_DETAIL_FRAME_SIZE):
+    height, width = frame.shape[:2]
+    scale = max_size / max(height, width)
+    if scale >= 1:
+        return frame
+    return cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+def encode_frame(frame, max_size=LOW_DETAIL_FRAME_SIZE):
+    _, buffer = cv2.imencode(".jpg", downscale_frame(frame, max_size), [cv2.IMWRITE_JPEG_QUALITY, FRAME_JPEG_QUALITY])
+    return base64.b64encode(buffer).decode("utf-8")
+
+def frame_signature(frame):
+    small = cv2.resize(frame, SCENE_SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
 
+def iter_video_frames(video_path, seconds_per_frame=2, scene_threshold=None):
+    # Decodes sequentially: grab() advances past frames without converting them,
+    # and retrieve() is only called for frames that are actually inspected. This
+    # avoids the seek-per-sample cost of CAP_PROP_POS_FRAMES, which makes most
+    # codecs decode again from the previous keyframe.
+    #
+    # With scene_threshold set (0-1, mean absolute difference of a small
+    # grayscale signature), a frame is kept whenever the picture has changed
+    # that much since the last kept frame, instead of every seconds_per_frame.
     video = cv2.VideoCapture(video_path)
-    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = video.get(cv2.CAP_PROP_FPS)
-    frames_to_skip = int(fps * seconds_per_frame)
-    curr_frame = 0
-
-    while curr_frame < total_frames - 1:
-        video.set(cv2.CAP_PROP_POS_FRAMES, curr_frame)
-        success, frame = video.read()
-        if not success:
-            break
-        _, buffer = cv2.imencode(".jpg", frame)
-        base64_frames.append(base64.b64encode(buffer).decode("utf-8"))
-        curr_frame += frames_to_skip
-
-    video.release()
+    try:
+        fps = video.get(cv2.CAP_PROP_FPS) or 30
+        if scene_threshold:
+            step = max(1, int(fps * SCENE_CHECK_SECONDS))
+        else:
+            step = max(1, int(fps * seconds_per_frame))
+        last_signature = None
+        index = 0
+        while video.grab():
+            if index % step == 0:
+                success, frame = video.retrieve()
+                if not success:
+                    break
+                if scene_threshold:
+                    signature = frame_signature(frame)
+                    if last_signature is None or cv2.absdiff(signature, last_signature).mean() / 255 >= scene_threshold:
+                        last_signature = signature
+                        yield frame
+                else:
+                    yield frame
+            index += 1
+    finally:
+        video.release()
 
+def iter_encoded_frames(video_path, executor, seconds_per_frame=2, scene_threshold=None):
+    # Frames are encoded on the pool while this thread keeps decoding; results
+    # are yielded in order as soon as the oldest one is ready
+    pending = deque()
+    for frame in iter_video_frames(video_path, seconds_per_frame, scene_threshold):
+        pending.append(executor.submit(encode_frame, frame))
+        # Bound the number of decoded frames waiting in memory
+        while pending and (pending[0].done() or len(pending) > 2 * VIDEO_WORKERS):
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def extract_audio(video_path):
+    base_video_path, _ = os.path.splitext(video_path)
     audio_path = f"{base_video_path}.mp3"
     clip = VideoFileClip(video_path)
-    clip.audio.write_audiofile(audio_path, bitrate="32k")
-    clip.audio.close()
-    clip.close()
+    try:
+        if clip.audio is None:
+            return None
+        clip.audio.write_audiofile(audio_path, bitrate="32k", logger=None)
+        clip.audio.close()
+    finally:
+        clip.close()
+    return audio_path
+
+def extract_and_transcribe(video_path, transcribe, transcript_cache=None):
+    # With a transcript cache (see response_cache.CachedTranscriber) the video
+    # file is hashed first; a video seen before skips extraction and upload
+    key = None
+    if transcribe and transcript_cache:
+        key = transcript_cache.source_key(video_path)
+        cached = transcript_cache.lookup(key)
+        if cached is not None:
+            return None, cached
+    audio_path = extract_audio(video_path)
+    transcribed_text = transcribe(audio_path) if transcribe and audio_path else None
+    if key and transcribed_text is not None:
+        transcript_cache.store(key, transcribed_text)
+    return audio_path, transcribed_text
+
+def process_video_and_transcribe(video_path, transcribe, seconds_per_frame=2, scene_threshold=None, transcript_cache=None):
+    # Frame sampling runs while the audio is extracted and uploaded for transcription
+    with ThreadPoolExecutor(max_workers=VIDEO_WORKERS) as executor:
+        transcription_future = executor.submit(extract_and_transcribe, video_path, transcribe, transcript_cache)
+        base64_frames = list(iter_encoded_frames(video_path, executor, seconds_per_frame, scene_threshold))
+        audio_path, transcribed_text = transcription_future.result()
+    return base64_frames, audio_path, transcribed_text
 
-    return base64_frames, audio_path
\ No newline at end of file
+def process_video(video_path, seconds_per_frame=2, scene_threshold=None):
+    base64_frames, audio_path, _ = process_video_and_transcribe(video_path, None, seconds_per_frame, scene_threshold)
+    return base64_frames, audio_path
@@ -0,0 +1,101 @@
+# IConvo/yaml_highlighter.py
+
+from pygments.lexers import YamlLexer
+from pygments.token import Token
+
+# Pause after the last keystroke before the edited lines are highlighted again
+HIGHLIGHT_DELAY_MS = 150
+TAG_COLORS = {
+    Token.Keyword: "blue",
+    Token.Literal.Scalar: "black",
+    Token.Literal.String: "green",
+    Token.Literal.Number: "purple",
+    Token.Comment: "gray",
+}
+
+def tag_for(token):
+    # Subtypes such as Token.Literal.Scalar.Plain use their nearest styled parent
+    while token is not Token:
+        if token in TAG_COLORS:
+            return str(token)
+        token = token.parent
+    return None
+
+def is_top_level(line):
+    return bool(line) and not line[0].isspace() and not line.startswith("#")
+
+class YamlHighlighter:
+    # Live YAML highlighting for a Text widget. Edits are debounced; then the
+    # new text is compared with the last highlighted copy, and only the
+    # changed lines are lexed again. The range is widened to whole top-level
+    # blocks, because a multi-line value (the system prompt) can only be lexed
+    # from its key. Old tags are removed inside that range only, and the new
+    # ranges go to Tk in one tag_add call per tag.
+
+    def __init__(self, widget, delay_ms=HIGHLIGHT_DELAY_MS):
+        self.widget = widget
+        self.delay_ms = delay_ms
+        self.lexer = YamlLexer(stripnl=False)
+        self.lines = []
+        self.scheduled = None
+        for token, color in TAG_COLORS.items():
+            widget.tag_configure(str(token), foreground=color)
+        widget.bind("<<Modified>>", self.on_modified, add="+")
+        # Loading the text already set the modified flag, which would swallow the first edit
+        widget.edit_modified(False)
+        self.highlight()
+
+    def on_modified(self, event=None):
+        # <<Modified>> only fires again once the flag is reset
+        self.widget.edit_modified(False)
+        if self.scheduled is not None:
+            self.widget.after_cancel(self.scheduled)
+        self.scheduled = self.widget.after(self.delay_ms, self.highlight)
+
+    def changed_lines(self, lines):
+        # Returns the first and one past the last line that differ from the last highlighted text
+        old = self.lines
+        start = 0
+        while start < min(len(lines), len(old)) and lines[start] == old[start]:
+            start += 1
+        end, old_end = len(lines), len(old)
+        while end > start and old_end > start and lines[end - 1] == old[old_end - 1]:
+            end -= 1
+            old_end -= 1
+        start = min(start, len(lines) - 1)
+        return start, max(end, start + 1)
+
+    def block_range(self, lines, start, end):
+        while start > 0 and not is_top_level(lines[start]):
+            start -= 1
+        while end < len(lines) and not is_top_level(lines[end]):
+            end += 1
+        return start, end
+
+    def highlight(self):
+        self.scheduled = None
+        lines = self.widget.get("1.0", "end-1c").split("\n")
+        if lines == self.lines:
+            return
+        start, end = self.block_range(lines, *self.changed_lines(lines))
+        self.lines = lines
+
+        ranges = {str(token): [] for token in TAG_COLORS}
+        row, column = start + 1, 0
+        for token, content in self.lexer.get_tokens("\n".join(lines[start:end]) + "\n"):
+            tag = tag_for(token)
+            first = f"{row}.{column}"
+            newlines = content.count("\n")
+            if newlines:
+                row += newlines
+                column = len(content) - content.rfind("\n") - 1
+            else:
+                column += len(content)
+            if tag and content.strip():
+                ranges[tag].extend((first, f"{row}.{column}"))
+
+        region = (f"{start + 1}.0", f"{end + 1}.0")
+        for tag, indices in ranges.items():
+            self.widget.tag_remove(tag, *region)
+            if indices:
+                self.widget.tag_add(tag, *indices)